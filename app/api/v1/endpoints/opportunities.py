@@ -1,26 +1,71 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, desc, func
-from typing import List, Optional
-from datetime import datetime, timedelta
+from sqlalchemy import select, and_, desc, func, tuple_, lambda_stmt
+from sqlalchemy.orm import selectinload
+from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import base64
+import hashlib
+import logging
 import uuid
+import orjson
 
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.cache import redis_client
 from app.models.events import ArbitrageOpportunity, Event
 from app.services.ai_analyzer import ai_analyzer
 from app.api.v1.schemas.opportunities import (
     OpportunityResponse, 
+    OpportunityListItem,
     OpportunityListResponse,
     OpportunityAnalysisRequest,
     OpportunityAnalysisResponse
 )
 from app.core.security import get_current_user
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+# Dashboards poll these endpoints; let clients revalidate cheaply
+ETAG_CACHE_CONTROL = "private, max-age=5"
+
+def _make_etag(*parts) -> str:
+    """Build a weak ETag from values that change whenever the response would"""
+    digest = hashlib.blake2b(":".join(str(part) for part in parts).encode(), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Check the request's If-None-Match header against an ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return any(tag.strip() in (etag, "*") for tag in if_none_match.split(","))
+
+def _not_modified(etag: str) -> Response:
+    """Empty 304 response for a client whose cached copy is still current"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL})
+
+def _encode_cursor(profit_percentage: float, opportunity_id: uuid.UUID) -> str:
+    """Encode the keyset position of the last row on a page"""
+    raw = f"{profit_percentage!r}:{opportunity_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str) -> Tuple[float, uuid.UUID]:
+    """Decode a cursor produced by _encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        profit_percentage, opportunity_id = raw.split(":", 1)
+        return float(profit_percentage), uuid.UUID(opportunity_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/", response_model=OpportunityListResponse)
 async def list_opportunities(
-    skip: int = Query(0, ge=0),
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = Query(None),
     limit: int = Query(50, ge=1, le=100),
     min_profit: Optional[float] = Query(None, ge=0),
     max_risk: Optional[float] = Query(None, ge=1, le=10),
@@ -29,10 +74,10 @@ async def list_opportunities(
     db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    """List arbitrage opportunities with filtering"""
+    """List arbitrage opportunities with filtering and keyset pagination"""
     try:
         # Build query conditions
-        conditions = [ArbitrageOpportunity.expires_at > datetime.utcnow()]
+        conditions = [ArbitrageOpportunity.expires_at > func.now()]
         
         if min_profit is not None:
             conditions.append(ArbitrageOpportunity.profit_percentage >= min_profit)
@@ -43,109 +88,101 @@ async def list_opportunities(
         if status:
             conditions.append(ArbitrageOpportunity.status == status)
         
-        # Join with events for sport filtering
+        if sport:
+            conditions.append(ArbitrageOpportunity.event.has(Event.sport == sport))
+        
+        # Seek past the last row of the previous page instead of OFFSET
+        if cursor:
+            cursor_profit, cursor_id = _decode_cursor(cursor)
+            conditions.append(
+                tuple_(ArbitrageOpportunity.profit_percentage, ArbitrageOpportunity.id)
+                < tuple_(cursor_profit, cursor_id)
+            )
+        
+        # Events are fetched in one batched IN query rather than widened through a join;
+        # one extra row tells us whether another page exists
         query = (
-            select(ArbitrageOpportunity, Event)
-            .join(Event, ArbitrageOpportunity.event_id == Event.id)
+            select(ArbitrageOpportunity)
+            .options(selectinload(ArbitrageOpportunity.event))
             .where(and_(*conditions))
+            .order_by(desc(ArbitrageOpportunity.profit_percentage), desc(ArbitrageOpportunity.id))
+            .limit(limit + 1)
         )
+        result = await db.execute(query)
+        page = result.scalars().all()
         
-        if sport:
-            query = query.where(Event.sport == sport)
+        has_more = len(page) > limit
+        page = page[:limit]
         
-        # Get total count
-        count_query = select(func.count()).select_from(query.subquery())
-        count_result = await db.execute(count_query)
-        total = count_result.scalar()
+        next_cursor = None
+        if has_more:
+            next_cursor = _encode_cursor(page[-1].profit_percentage, page[-1].id)
         
-        # Get paginated results
-        query = query.order_by(desc(ArbitrageOpportunity.profit_percentage)).offset(skip).limit(limit)
-        result = await db.execute(query)
-        opportunities_with_events = result.all()
+        # Fingerprint the rows on this page (membership, order and the fields that change after
+        # detection); a 304 still runs the page query and only skips building the body
+        etag = _make_etag(
+            request.url.query,
+            next_cursor,
+            *(f"{opp.id}/{opp.status}/{opp.risk_score}/{opp.ai_score}" for opp in page)
+        )
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
         
-        # Format response
-        opportunities = []
-        for opp, event in opportunities_with_events:
-            opp_dict = {
-                "id": str(opp.id),
-                "event_id": str(opp.event_id),
-                "market_type": opp.market_type,
-                "profit_percentage": opp.profit_percentage,
-                "expected_profit": opp.expected_profit,
-                "total_stake": opp.total_stake,
-                "risk_score": opp.risk_score,
-                "ai_score": opp.ai_score,
-                "status": opp.status,
-                "detected_at": opp.detected_at,
-                "expires_at": opp.expires_at,
-                "bookmaker_stakes": opp.bookmaker_stakes,
-                "bookmaker_odds": opp.bookmaker_odds,
-                "event": {
-                    "sport": event.sport,
-                    "teams": event.teams,
-                    "commence_time": event.commence_time
-                }
-            }
-            opportunities.append(opp_dict)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = ETAG_CACHE_CONTROL
         
         return OpportunityListResponse(
-            opportunities=opportunities,
-            total=total,
-            skip=skip,
+            opportunities=[OpportunityListItem.model_validate(opp) for opp in page],
+            next_cursor=next_cursor,
+            has_more=has_more,
             limit=limit
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching opportunities: {str(e)}")
 
 @router.get("/{opportunity_id}", response_model=OpportunityResponse)
 async def get_opportunity(
     opportunity_id: str,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """Get a specific arbitrage opportunity"""
     try:
         opportunity_uuid = uuid.UUID(opportunity_id)
-        
-        query = (
-            select(ArbitrageOpportunity, Event)
-            .join(Event, ArbitrageOpportunity.event_id == Event.id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid opportunity ID format")
+    
+    try:
+        # Lambda statements are compiled once and cached by code location
+        query = lambda_stmt(
+            lambda: select(ArbitrageOpportunity)
+            .options(selectinload(ArbitrageOpportunity.event))
             .where(ArbitrageOpportunity.id == opportunity_uuid)
         )
         
         result = await db.execute(query)
-        opp_with_event = result.first()
+        opp = result.scalar_one_or_none()
         
-        if not opp_with_event:
+        if not opp:
             raise HTTPException(status_code=404, detail="Opportunity not found")
         
-        opp, event = opp_with_event
+        analysis_timestamp = (opp.ai_analysis or {}).get("analysis_timestamp")
+        etag = _make_etag(opp.id, opp.status, opp.ai_score, analysis_timestamp, opp.expires_at)
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
         
-        return OpportunityResponse(
-            id=str(opp.id),
-            event_id=str(opp.event_id),
-            market_type=opp.market_type,
-            profit_percentage=opp.profit_percentage,
-            expected_profit=opp.expected_profit,
-            total_stake=opp.total_stake,
-            risk_score=opp.risk_score,
-            ai_score=opp.ai_score,
-            ai_analysis=opp.ai_analysis,
-            status=opp.status,
-            detected_at=opp.detected_at,
-            expires_at=opp.expires_at,
-            bookmaker_stakes=opp.bookmaker_stakes,
-            bookmaker_odds=opp.bookmaker_odds,
-            event={
-                "sport": event.sport,
-                "teams": event.teams,
-                "commence_time": event.commence_time
-            }
-        )
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = ETAG_CACHE_CONTROL
         
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid opportunity ID format")
+        return OpportunityResponse.model_validate(opp)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching opportunity: {str(e)}")
 
@@ -161,14 +198,16 @@ async def analyze_opportunity(
         opportunity_uuid = uuid.UUID(opportunity_id)
         
         # Check if opportunity exists
-        stmt = select(ArbitrageOpportunity).where(ArbitrageOpportunity.id == opportunity_uuid)
+        stmt = lambda_stmt(
+            lambda: select(ArbitrageOpportunity).where(ArbitrageOpportunity.id == opportunity_uuid)
+        )
         result = await db.execute(stmt)
         opportunity = result.scalar_one_or_none()
         
         if not opportunity:
             raise HTTPException(status_code=404, detail="Opportunity not found")
         
-        if opportunity.expires_at <= datetime.utcnow():
+        if opportunity.expires_at and opportunity.expires_at <= datetime.now(timezone.utc):
             raise HTTPException(status_code=400, detail="Opportunity has expired")
         
         # Trigger AI analysis in background
@@ -180,6 +219,8 @@ async def analyze_opportunity(
             message="AI analysis has been queued and will be completed shortly"
         )
         
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid opportunity ID format")
     except Exception as e:
@@ -192,50 +233,45 @@ async def get_opportunities_summary(
     current_user = Depends(get_current_user)
 ):
     """Get summary statistics for arbitrage opportunities"""
+    # The underlying data only changes once per detection cycle
+    cache_key = f"summary:{days}"
     try:
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Total opportunities
-        total_stmt = (
-            select(func.count(ArbitrageOpportunity.id))
-            .where(ArbitrageOpportunity.detected_at >= cutoff_date)
-        )
-        total_result = await db.execute(total_stmt)
-        total_opportunities = total_result.scalar()
+        cached = await redis_client.get(cache_key)
+        if cached:
+            return orjson.loads(cached)
+    except Exception as e:
+        logger.warning(f"Summary cache read failed: {e}")
+    
+    try:
+        now = datetime.now(timezone.utc)
+        cutoff_date = now - timedelta(days=days)
         
-        # Active opportunities
-        active_stmt = (
-            select(func.count(ArbitrageOpportunity.id))
-            .where(
-                and_(
-                    ArbitrageOpportunity.detected_at >= cutoff_date,
-                    ArbitrageOpportunity.status.in_(["detected", "analyzed"]),
-                    ArbitrageOpportunity.expires_at > datetime.utcnow()
-                )
+        # Total, active, average and best in a single pass over the period
+        totals_stmt = lambda_stmt(
+            lambda: select(
+                func.count(ArbitrageOpportunity.id).label("total"),
+                func.count(ArbitrageOpportunity.id).filter(
+                    and_(
+                        ArbitrageOpportunity.status.in_(["detected", "analyzed"]),
+                        ArbitrageOpportunity.expires_at > func.now()
+                    )
+                ).label("active"),
+                func.avg(ArbitrageOpportunity.profit_percentage).label("avg_profit"),
+                func.max(ArbitrageOpportunity.profit_percentage).label("best_profit")
             )
-        )
-        active_result = await db.execute(active_stmt)
-        active_opportunities = active_result.scalar()
-        
-        # Average profit
-        avg_profit_stmt = (
-            select(func.avg(ArbitrageOpportunity.profit_percentage))
             .where(ArbitrageOpportunity.detected_at >= cutoff_date)
         )
-        avg_profit_result = await db.execute(avg_profit_stmt)
-        avg_profit = avg_profit_result.scalar() or 0
+        totals_result = await db.execute(totals_stmt)
+        totals = totals_result.one()
         
-        # Best opportunity
-        best_stmt = (
-            select(func.max(ArbitrageOpportunity.profit_percentage))
-            .where(ArbitrageOpportunity.detected_at >= cutoff_date)
-        )
-        best_result = await db.execute(best_stmt)
-        best_profit = best_result.scalar() or 0
+        total_opportunities = totals.total
+        active_opportunities = totals.active
+        avg_profit = totals.avg_profit or 0
+        best_profit = totals.best_profit or 0
         
         # Opportunities by sport
-        sport_stmt = (
-            select(Event.sport, func.count(ArbitrageOpportunity.id))
+        sport_stmt = lambda_stmt(
+            lambda: select(Event.sport, func.count(ArbitrageOpportunity.id))
             .join(Event, ArbitrageOpportunity.event_id == Event.id)
             .where(ArbitrageOpportunity.detected_at >= cutoff_date)
             .group_by(Event.sport)
@@ -244,15 +280,22 @@ async def get_opportunities_summary(
         sport_result = await db.execute(sport_stmt)
         sport_breakdown = dict(sport_result.all())
         
-        return {
+        summary = {
             "period_days": days,
             "total_opportunities": total_opportunities,
             "active_opportunities": active_opportunities,
             "average_profit_percentage": round(float(avg_profit), 2),
             "best_profit_percentage": round(float(best_profit), 2),
             "sport_breakdown": sport_breakdown,
-            "generated_at": datetime.utcnow()
+            "generated_at": now
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating summary: {str(e)}")
+    
+    try:
+        await redis_client.set(cache_key, orjson.dumps(summary), ex=settings.ARBITRAGE_DETECTION_INTERVAL)
+    except Exception as e:
+        logger.warning(f"Summary cache write failed: {e}")
+    
+    return summary
@@ -1,8 +1,11 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
+from uuid import UUID
 
 class EventInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
     sport: str
     teams: List[str]
     commence_time: datetime
@@ -17,8 +20,10 @@ class OpportunityBase(BaseModel):
     bookmaker_odds: Dict[str, Dict[str, float]]
 
 class OpportunityResponse(OpportunityBase):
-    id: str
-    event_id: str
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: UUID
+    event_id: UUID
     ai_score: Optional[float] = None
     ai_analysis: Optional[Dict[str, Any]] = None
     status: str
@@ -27,8 +32,10 @@ class OpportunityResponse(OpportunityBase):
     event: EventInfo
 
 class OpportunityListItem(BaseModel):
-    id: str
-    event_id: str
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: UUID
+    event_id: UUID
     market_type: str
     profit_percentage: float
     expected_profit: float
@@ -44,8 +51,8 @@ class OpportunityListItem(BaseModel):
 
 class OpportunityListResponse(BaseModel):
     opportunities: List[OpportunityListItem]
-    total: int
-    skip: int
+    next_cursor: Optional[str] = None
+    has_more: bool
     limit: int
 
 class OpportunityAnalysisRequest(BaseModel):
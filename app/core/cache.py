@@ -0,0 +1,19 @@
+import redis.asyncio as redis
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Shared Redis client - connections are opened lazily from its pool
+redis_client = redis.from_url(
+    settings.REDIS_URL,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    decode_responses=False
+)
+
+async def close_redis():
+    """Close the shared Redis connection pool"""
+    try:
+        await redis_client.close()
+    except Exception as e:
+        logger.warning(f"Error closing Redis client: {e}")
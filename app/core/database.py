@@ -1,19 +1,45 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import MetaData
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from sqlalchemy import MetaData, cast
+from sqlalchemy.dialects.postgresql import JSONB
 from app.core.config import settings
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
 # Database engine
+if settings.DB_USE_PGBOUNCER:
+    # PgBouncer owns the connection pool, so don't hold connections in-process.
+    # Transaction-mode pooling can't keep server-side prepared statements either.
+    pool_kwargs = {"poolclass": NullPool}
+    statement_cache_size = 0
+else:
+    pool_kwargs = {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_pre_ping": True,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+    statement_cache_size = settings.DB_STATEMENT_CACHE_SIZE
+
+def _json_serializer(obj) -> str:
+    """Serialize JSONB values with orjson; non-str keys are stringified like the stdlib does"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=settings.DEBUG,
-    pool_size=20,
-    max_overflow=30,
-    pool_pre_ping=True,
-    pool_recycle=3600,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+    connect_args={
+        # asyncpg's own cache and SQLAlchemy's adapter-level cache of prepared statements
+        "statement_cache_size": statement_cache_size,
+        "prepared_statement_cache_size": statement_cache_size,
+    },
+    **pool_kwargs,
 )
 
 # Session factory
@@ -34,6 +60,10 @@ class Base(DeclarativeBase):
         }
     )
 
+def jsonb_contains(column, payload):
+    """JSONB containment filter (column @> payload), the form GIN jsonb_path_ops indexes can serve"""
+    return column.op("@>")(cast(payload, JSONB))
+
 async def get_db() -> AsyncSession:
     """Database dependency"""
     async with AsyncSessionLocal() as session:
@@ -1,56 +1,87 @@
 import time
+import itertools
 import logging
-from typing import Callable
-from fastapi import Request, Response, HTTPException
+import secrets
 from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import redis.asyncio as redis
+from cachetools import LRUCache
 from app.core.config import settings
-import uuid
 
 logger = logging.getLogger(__name__)
 
+# Fixed-window counter: takes a lease of ARGV[2] requests at once; the TTL is only
+# set when the window opens, so it rolls over on schedule
+RATE_LIMIT_SCRIPT = """
+local current = redis.call('INCRBY', KEYS[1], ARGV[2])
+if current == tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return current
+"""
+
+# Correlation IDs: random per-process prefix plus a counter - unique without a syscall per request
+_CORRELATION_PREFIX = secrets.token_hex(4)
+_correlation_counter = itertools.count()
+
+# Probes and docs bypass logging and rate limiting entirely
+_SKIP_PATHS = frozenset({"/health", "/docs", "/redoc", "/openapi.json", "/metrics", "/favicon.ico"})
+
 class LoggingMiddleware:
     """Middleware for request/response logging"""
     
-    def __init__(self, app):
+    def __init__(self, app: ASGIApp):
         self.app = app
 
-    async def __call__(self, request: Request, call_next: Callable) -> Response:
-        # Generate correlation ID
-        correlation_id = str(uuid.uuid4())
-        request.state.correlation_id = correlation_id
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in _SKIP_PATHS:
+            return await self.app(scope, receive, send)
+        
+        # Generate correlation ID and expose it as request.state.correlation_id
+        correlation_id = f"{_CORRELATION_PREFIX}-{next(_correlation_counter):x}"
+        scope.setdefault("state", {})["correlation_id"] = correlation_id
         
         # Log request
         start_time = time.time()
+        client = scope.get("client")
         logger.info(
-            f"Request started - {correlation_id} - {request.method} {request.url.path}",
+            f"Request started - {correlation_id} - {scope['method']} {scope['path']}",
             extra={
                 "correlation_id": correlation_id,
-                "method": request.method,
-                "path": request.url.path,
-                "query_params": str(request.query_params),
-                "client_ip": request.client.host if request.client else None
+                "method": scope["method"],
+                "path": scope["path"],
+                "query_params": scope.get("query_string", b"").decode("latin-1"),
+                "client_ip": client[0] if client else None
             }
         )
         
+        status_code = None
+        
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                
+                # Add correlation ID to response headers
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Correlation-ID", correlation_id)
+            await send(message)
+        
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
             
             # Log response
             process_time = time.time() - start_time
             logger.info(
-                f"Request completed - {correlation_id} - {response.status_code} - {process_time:.3f}s",
+                f"Request completed - {correlation_id} - {status_code} - {process_time:.3f}s",
                 extra={
                     "correlation_id": correlation_id,
-                    "status_code": response.status_code,
+                    "status_code": status_code,
                     "process_time": process_time
                 }
             )
             
-            # Add correlation ID to response headers
-            response.headers["X-Correlation-ID"] = correlation_id
-            return response
-            
         except Exception as e:
             process_time = time.time() - start_time
             logger.error(
@@ -66,45 +97,51 @@ class LoggingMiddleware:
 class RateLimitMiddleware:
     """Middleware for API rate limiting"""
     
-    def __init__(self, app):
+    def __init__(self, app: ASGIApp, redis_client: redis.Redis):
         self.app = app
-        self.redis_client = None
+        self.redis_client = redis_client
+        self.rate_limit_script = redis_client.register_script(RATE_LIMIT_SCRIPT)
         self.requests_per_window = settings.RATE_LIMIT_REQUESTS
         self.window_seconds = settings.RATE_LIMIT_WINDOW
-
-    async def __call__(self, request: Request, call_next: Callable) -> Response:
-        # Skip rate limiting for health checks
-        if request.url.path in ["/health", "/docs", "/redoc", "/openapi.json"]:
-            return await call_next(request)
         
-        # Initialize Redis client if needed
-        if not self.redis_client:
-            try:
-                self.redis_client = redis.from_url(settings.REDIS_URL)
-            except Exception as e:
-                logger.warning(f"Redis not available for rate limiting: {e}")
-                return await call_next(request)
+        # Requests leased from the shared Redis counter per round-trip. Every served request
+        # is counted in Redis before it is served, so the limit holds across all workers.
+        self.lease_size = max(1, min(settings.RATE_LIMIT_LEASE_SIZE, self.requests_per_window))
+        
+        # Per-process leases: {client_id: (window, requests_left)}
+        self.local_leases: LRUCache = LRUCache(maxsize=50_000)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in _SKIP_PATHS:
+            return await self.app(scope, receive, send)
         
         # Get client identifier
-        client_ip = request.client.host if request.client else "unknown"
-        auth_header = request.headers.get("authorization")
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        auth_header = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                auth_header = value.decode("latin-1")
+                break
         
         # Use user ID if authenticated, otherwise use IP
         if auth_header:
-            try:
-                # Extract user ID from token (simplified)
-                client_id = f"user:{auth_header[-10:]}"  # Use last 10 chars of token
-            except:
-                client_id = f"ip:{client_ip}"
+            # Extract user ID from token (simplified)
+            client_id = f"user:{auth_header[-10:]}"  # Use last 10 chars of token
         else:
             client_id = f"ip:{client_ip}"
         
+        # Requests covered by this process's current lease never touch Redis
+        window = int(time.time() // self.window_seconds)
+        if self._consume_lease(client_id, window):
+            return await self.app(scope, receive, send)
+        
         # Check rate limit
         try:
-            current_requests = await self._check_rate_limit(client_id)
+            granted = await self._lease_requests(client_id, window)
             
-            if current_requests > self.requests_per_window:
-                return JSONResponse(
+            if granted <= 0:
+                response = JSONResponse(
                     status_code=429,
                     content={
                         "error": "Rate limit exceeded",
@@ -113,26 +150,37 @@ class RateLimitMiddleware:
                     },
                     headers={"Retry-After": str(self.window_seconds)}
                 )
+                return await response(scope, receive, send)
             
         except Exception as e:
             logger.warning(f"Rate limiting check failed: {e}")
             # Continue without rate limiting if Redis fails
         
-        return await call_next(request)
+        await self.app(scope, receive, send)
 
-    async def _check_rate_limit(self, client_id: str) -> int:
-        """Check and update rate limit for client"""
-        key = f"rate_limit:{client_id}"
+    def _consume_lease(self, client_id: str, window: int) -> bool:
+        """Serve a request from the client's leased allowance for this window, if any is left"""
+        lease = self.local_leases.get(client_id)
+        if lease is None or lease[0] != window or lease[1] <= 0:
+            return False
+        
+        self.local_leases[client_id] = (window, lease[1] - 1)
+        return True
+
+    async def _lease_requests(self, client_id: str, window: int) -> int:
+        """Take a lease from the client's shared window counter; returns requests granted"""
+        key = f"rate_limit:{client_id}:{window}"
         
         try:
-            # Use Redis pipeline for atomic operations
-            pipe = self.redis_client.pipeline()
-            pipe.incr(key)
-            pipe.expire(key, self.window_seconds)
-            results = await pipe.execute()
-            
-            return results[0]
+            # Single round-trip; the script runs atomically on the server
+            current = await self.rate_limit_script(keys=[key], args=[self.window_seconds, self.lease_size])
             
         except Exception as e:
             logger.error(f"Redis rate limit error: {e}")
-            return 0  # Allow request if Redis fails
+            return 1  # Allow request if Redis fails
+        
+        # Only the part of the lease still under the limit is granted; this request uses one
+        granted = min(self.lease_size, self.requests_per_window - (current - self.lease_size))
+        if granted > 0:
+            self.local_leases[client_id] = (window, granted - 1)
+        return granted
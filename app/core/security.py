@@ -1,52 +1,120 @@
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 import jwt
-from passlib.context import CryptContext
+import bcrypt
+from cachetools import TTLCache
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.core.config import settings
 import logging
 from app.models.events import User
 from app.core.database import AsyncSessionLocal
+from app.core.cache import redis_client
 from sqlalchemy import select
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # JWT token scheme
 security = HTTPBearer()
 
+# Claims every access token carries, so get_current_user can skip the users table
+ACCESS_TOKEN_CLAIMS = ("sub", "email", "is_active", "permissions")
+
+# Verified token -> decoded payload; TTLCache isn't thread-safe and sync callers may run in the threadpool
+_jwt_cache: TTLCache = TTLCache(maxsize=20000, ttl=30)
+_jwt_cache_lock = threading.Lock()
+
 class SecurityManager:
     def __init__(self):
         self.algorithm = settings.JWT_ALGORITHM
         self.secret_key = settings.JWT_SECRET_KEY
         self.access_token_expire_minutes = settings.JWT_EXPIRE_MINUTES
         self.refresh_token_expire_days = settings.JWT_REFRESH_EXPIRE_DAYS
+        self.bcrypt_rounds = settings.BCRYPT_ROUNDS
 
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+        try:
+            return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+        except ValueError:
+            # Malformed or non-bcrypt hash
+            return False
 
     def get_password_hash(self, password: str) -> str:
         """Hash a password"""
-        return pwd_context.hash(password)
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=self.bcrypt_rounds)).decode()
 
     def create_access_token(self, data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
         """Create a JWT access token"""
+        missing = [claim for claim in ACCESS_TOKEN_CLAIMS if claim not in data]
+        if missing:
+            raise ValueError(f"Access token data is missing claims: {', '.join(missing)}")
+        
         to_encode = data.copy()
         
+        issued_at = datetime.utcnow()
         if expires_delta:
-            expire = datetime.utcnow() + expires_delta
+            expire = issued_at + expires_delta
         else:
-            expire = datetime.utcnow() + timedelta(minutes=self.access_token_expire_minutes)
+            expire = issued_at + timedelta(minutes=self.access_token_expire_minutes)
         
-        to_encode.update({"exp": expire, "type": "access"})
+        to_encode.update({"exp": expire, "iat": issued_at, "type": "access", "jti": uuid.uuid4().hex})
         
         encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
         return encoded_jwt
 
+    def create_user_access_token(self, user: User, expires_delta: Optional[timedelta] = None) -> str:
+        """Create an access token carrying the claims get_current_user needs"""
+        return self.create_access_token(
+            {
+                "sub": str(user.id),
+                "email": user.email,
+                "is_active": user.is_active,
+                "permissions": user.permissions or []
+            },
+            expires_delta
+        )
+
+    async def revoke_token(self, payload: Dict[str, Any]):
+        """Deny-list a token's jti until the token would have expired anyway"""
+        jti = payload.get("jti")
+        if not jti:
+            return
+        
+        ttl = int(payload.get("exp", 0) - time.time())
+        if ttl > 0:
+            await redis_client.set(f"revoked_jti:{jti}", 1, ex=ttl)
+
+    async def revoke_user_tokens(self, user_id: str):
+        """Invalidate every access token issued to a user so far - call after deactivating
+        a user or changing their permissions, since those live in the token's claims"""
+        await redis_client.set(
+            f"revoked_before:{user_id}",
+            int(time.time()),
+            ex=self.access_token_expire_minutes * 60
+        )
+
+    async def is_token_revoked(self, payload: Dict[str, Any]) -> bool:
+        """Check the Redis deny-lists for a token's jti and its user's cutoff, in one round-trip"""
+        try:
+            revoked_jti, revoked_before = await redis_client.mget(
+                f"revoked_jti:{payload['jti']}",
+                f"revoked_before:{payload['sub']}"
+            )
+            if revoked_jti is not None:
+                return True
+            return revoked_before is not None and payload.get("iat", 0) <= int(revoked_before)
+        except Exception as e:
+            # Fail closed: a revoked token must not work just because Redis is unreachable
+            logger.error(f"Token revocation check failed: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Could not verify token status"
+            )
+
     def create_refresh_token(self, data: Dict[str, Any]) -> str:
         """Create a JWT refresh token"""
         to_encode = data.copy()
@@ -59,23 +127,34 @@ class SecurityManager:
 
     def verify_token(self, token: str, token_type: str = "access") -> Dict[str, Any]:
         """Verify and decode a JWT token"""
+        with _jwt_cache_lock:
+            payload = _jwt_cache.get(token)
+        
+        # Never serve a cached payload past the token's own expiry
+        if payload is None or payload.get("exp", 0) <= time.time():
+            payload = self._decode_token(token)
+            with _jwt_cache_lock:
+                _jwt_cache[token] = payload
+        
+        if payload.get("type") != token_type:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token type"
+            )
+        
+        return payload
+
+    def _decode_token(self, token: str) -> Dict[str, Any]:
+        """Check the signature and expiry of a JWT token"""
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
-            
-            if payload.get("type") != token_type:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid token type"
-                )
-            
-            return payload
+            return jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
             
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token has expired"
             )
-        except jwt.JWTError:
+        except jwt.InvalidTokenError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials"
@@ -84,18 +163,58 @@ class SecurityManager:
 # Global security manager instance
 security_manager = SecurityManager()
 
+async def _resolve_token(token: str) -> Dict[str, Any]:
+    """Resolve an access token to a user dict; the decode itself is memoized in verify_token"""
+    payload = security_manager.verify_token(token)
+    
+    # Tokens minted without the user claims can't be trusted to stand in for the users row
+    if any(payload.get(claim) is None for claim in ACCESS_TOKEN_CLAIMS + ("jti",)):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials"
+        )
+    
+    if await security_manager.is_token_revoked(payload):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked"
+        )
+    
+    if not payload["is_active"]:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User is inactive"
+        )
+    
+    return {
+        "id": payload["sub"],
+        "email": payload["email"],
+        "is_active": payload["is_active"],
+        "permissions": payload["permissions"]
+    }
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Get current user from JWT token"""
+    """Get current user from the signed JWT claims, without a database lookup"""
+    return await _resolve_token(credentials.credentials)
+
+async def get_current_user_fresh(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Get current user from the database - for sensitive routes that need the live row"""
     try:
         payload = security_manager.verify_token(credentials.credentials)
         user_id = payload.get("sub")
         
-        if user_id is None:
+        if user_id is None or payload.get("jti") is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials"
             )
         
+        if await security_manager.is_token_revoked(payload):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked"
+            )
+        
         async with AsyncSessionLocal() as session:
             result = await session.execute(select(User).where(User.id == user_id))
             user = result.scalars().first()
@@ -105,6 +224,13 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="User not found"
                 )
+        
+        # The live row wins over the token's claims
+        if not user.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User is inactive"
+            )
 
         return {
             "id":str(user.id),
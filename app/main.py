@@ -1,13 +1,17 @@
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 import uvicorn
 from app.core.config import settings
 from app.core.database import init_db
+from app.core.cache import redis_client, close_redis
 from app.api.v1.router import api_router
 from app.core.middleware import LoggingMiddleware, RateLimitMiddleware
-from app.services.background_tasks import start_background_tasks
+from app.services.background_tasks import start_background_tasks, stop_background_tasks
+from app.services.ai_analyzer import ai_analyzer
+from app.services.odds_collector import odds_collector
 import logging
 
 # Configure logging
@@ -21,18 +25,24 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting arbitrage backend system...")
+    app.state.redis = redis_client
     await init_db()
     await start_background_tasks()
     logger.info("System startup complete")
     yield
     # Shutdown
     logger.info("Shutting down arbitrage backend system...")
+    await stop_background_tasks()
+    await ai_analyzer.aclose()
+    await odds_collector.aclose()
+    await close_redis()
 
 app = FastAPI(
     title="Sports Betting Arbitrage API",
     description="Production-ready arbitrage detection and management system",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs" if settings.ENVIRONMENT != "production" else None,
     redoc_url="/redoc" if settings.ENVIRONMENT != "production" else None,
 )
@@ -49,7 +59,7 @@ app.add_middleware(
 
 # Custom middleware
 app.add_middleware(LoggingMiddleware)
-app.add_middleware(RateLimitMiddleware)
+app.add_middleware(RateLimitMiddleware, redis_client=redis_client)
 
 # Include API routes
 app.include_router(api_router, prefix="/api/v1")
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, String, DateTime, JSON, Float, Integer, Boolean, Index
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, DateTime, Float, Integer, Boolean, Index, text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.core.database import Base
 import uuid
@@ -12,16 +13,17 @@ class Event(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     external_id = Column(String, unique=True, nullable=False, index=True)
     sport = Column(String, nullable=False, index=True)
-    teams = Column(JSON, nullable=False)
+    teams = Column(JSONB, nullable=False)
     commence_time = Column(DateTime(timezone=True), nullable=False, index=True)
     status = Column(String, default="upcoming", index=True)
-    metadata_ = Column(JSON, default=dict)
+    extra = Column("metadata_", JSONB, default=dict)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     __table_args__ = (
         Index('ix_events_sport_status', 'sport', 'status'),
         Index('ix_events_commence_time', 'commence_time'),
+        Index('ix_events_sport_commence', 'sport', 'commence_time'),
     )
 
 class OddsSnapshot(Base):
@@ -31,14 +33,41 @@ class OddsSnapshot(Base):
     event_id = Column(UUID(as_uuid=True), nullable=False, index=True)
     bookmaker = Column(String, nullable=False, index=True)
     market_type = Column(String, nullable=False, default="h2h")
-    odds_data = Column(JSON, nullable=False)
+    odds_data = Column(JSONB, nullable=False)
     captured_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     is_active = Column(Boolean, default=True, index=True)
     
     __table_args__ = (
         Index('ix_odds_event_bookmaker', 'event_id', 'bookmaker'),
         Index('ix_odds_captured_at', 'captured_at'),
-        Index('ix_odds_active_recent', 'is_active', 'captured_at'),
+        # Latest-snapshot-per-bookmaker lookup in the detector; odds_data stays in the heap
+        # since large payloads would exceed the btree tuple size limit
+        Index(
+            'ix_odds_active_recent',
+            event_id, bookmaker, captured_at.desc(),
+            postgresql_where=text("is_active = true"),
+        ),
+        # jsonb_path_ops: smaller and faster than the default opclass, serves @> containment only.
+        # Filter JSONB columns with jsonb_contains(); ->/->> comparisons fall back to a seq scan.
+        Index(
+            'ix_odds_data_gin', odds_data,
+            postgresql_using='gin',
+            postgresql_ops={'odds_data': 'jsonb_path_ops'},
+        ),
+    )
+
+class MarketArbCandidate(Base):
+    """Best-price implied probability total per market, refreshed whenever odds are stored"""
+    __tablename__ = "market_arb_candidates"
+    
+    event_id = Column(UUID(as_uuid=True), primary_key=True)
+    market_type = Column(String, primary_key=True)
+    min_implied_total = Column(Float, nullable=False)  # sum of 1/best price; below 1.0 is an arbitrage
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        # Detection only asks for markets under its profit threshold
+        Index('ix_arb_candidates_total', 'min_implied_total', 'updated_at'),
     )
 
 class ArbitrageOpportunity(Base):
@@ -49,21 +78,58 @@ class ArbitrageOpportunity(Base):
     market_type = Column(String, nullable=False)
     profit_percentage = Column(Float, nullable=False, index=True)
     total_stake = Column(Float, nullable=False)
-    bookmaker_stakes = Column(JSON, nullable=False)  # {bookmaker: {outcome: stake}}
-    bookmaker_odds = Column(JSON, nullable=False)    # {bookmaker: {outcome: odds}}
+    bookmaker_stakes = Column(JSONB, nullable=False)  # {bookmaker: {outcome: stake}}
+    bookmaker_odds = Column(JSONB, nullable=False)    # {bookmaker: {outcome: odds}}
     expected_profit = Column(Float, nullable=False)
     risk_score = Column(Float, default=0.0, index=True)
     ai_score = Column(Float, nullable=True, index=True)
-    ai_analysis = Column(JSON, nullable=True)
+    ai_analysis = Column(JSONB, nullable=True)
     status = Column(String, default="detected", index=True)  # detected, analyzed, executed, expired
     detected_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
     executed_at = Column(DateTime(timezone=True), nullable=True)
     
+    # No FK constraint on event_id, so the join is spelled out; must be eager-loaded explicitly
+    event = relationship(
+        "Event",
+        primaryjoin="ArbitrageOpportunity.event_id == Event.id",
+        foreign_keys=[event_id],
+        viewonly=True,
+        lazy="raise",
+    )
+    
     __table_args__ = (
         Index('ix_arb_profit_risk', 'profit_percentage', 'risk_score'),
         Index('ix_arb_status_detected', 'status', 'detected_at'),
-        Index('ix_arb_active', 'status', 'expires_at'),
+        # Covers the list endpoint's status/expiry filter and profit ordering; supersedes (status, expires_at)
+        Index(
+            'ix_arb_active_profit',
+            status, expires_at, profit_percentage.desc(),
+            postgresql_include=['risk_score', 'event_id', 'id'],
+        ),
+        Index('ix_arb_profit_id', profit_percentage.desc(), id.desc()),  # keyset pagination
+        # Containment only - query through jsonb_contains(), see OddsSnapshot
+        Index(
+            'ix_arb_stakes_gin', bookmaker_stakes,
+            postgresql_using='gin',
+            postgresql_ops={'bookmaker_stakes': 'jsonb_path_ops'},
+        ),
+        # Batch analysis picks the best unanalyzed rows; only 'detected' rows are indexed
+        Index(
+            'ix_arb_detected_profit',
+            profit_percentage.desc(),
+            postgresql_where=text("status = 'detected'"),
+            postgresql_include=['expires_at', 'id'],
+        ),
+        Index('ix_arb_pending', expires_at, postgresql_where=text("status = 'detected'")),
+        # Expiry sweep only ever touches rows that are still live
+        Index('ix_arb_expiring', expires_at, postgresql_where=text("status IN ('detected', 'analyzed')")),
+        # Market-conditions aggregate: index-only scan on the join key and 7-day cutoff
+        Index(
+            'ix_arb_event_detected',
+            event_id, detected_at,
+            postgresql_include=['profit_percentage'],
+        ),
     )
 
 class Portfolio(Base):
@@ -77,8 +143,8 @@ class Portfolio(Base):
     total_profit = Column(Float, default=0.0)
     total_bets = Column(Integer, default=0)
     win_rate = Column(Float, default=0.0)
-    bookmaker_balances = Column(JSON, default=dict)  # {bookmaker: balance}
-    risk_settings = Column(JSON, default=dict)
+    bookmaker_balances = Column(JSONB, default=dict)  # {bookmaker: balance}
+    risk_settings = Column(JSONB, default=dict)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -93,7 +159,8 @@ class BookmakerStatus(Base):
     last_successful_fetch = Column(DateTime(timezone=True), nullable=True)
     error_count = Column(Integer, default=0)
     rate_limit_reset = Column(DateTime(timezone=True), nullable=True)
-    metadata = Column(JSON, default=dict)
+    # "metadata" is reserved on declarative classes; only the Python attribute is renamed
+    extra = Column("metadata", JSONB, default=dict)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 class User(Base):
@@ -103,6 +170,6 @@ class User(Base):
     email = Column(String, unique=True, nullable=False, index=True)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
-    permissions = Column(JSON, default=list)
+    permissions = Column(JSONB, default=list)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
@@ -1,81 +1,192 @@
 import asyncio
 from typing import Dict, List, Any, Optional
 import logging
-from datetime import datetime, timedelta
-import json
-from openai import AsyncOpenAI
+from datetime import datetime, timedelta, timezone
+import uuid
+import httpx
+import orjson
+from openai import AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from cachetools import TTLCache
 from app.core.config import settings
 from app.models.events import ArbitrageOpportunity, Event, BookmakerStatus
 from app.core.database import AsyncSessionLocal
-from sqlalchemy import select, and_, update
+from sqlalchemy import select, and_, update, values, column, func
 
 logger = logging.getLogger(__name__)
 
+def _dumps(obj: Any) -> str:
+    """Pretty-print a prompt section as JSON"""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+
+class _JSONObjectScanner:
+    """Accumulates streamed text and detects when the top-level JSON object closes"""
+    
+    def __init__(self):
+        self.parts: List[str] = []
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+    
+    def feed(self, text: str) -> bool:
+        """Consume a chunk; True once the top-level object is complete"""
+        for i, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+                self.started = True
+            elif char == "}":
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    self.parts.append(text[:i + 1])
+                    return True
+        
+        self.parts.append(text)
+        return False
+    
+    def text(self) -> str:
+        return "".join(self.parts)
+
+# One HTTP/2 connection pool for all OpenAI traffic; concurrent requests multiplex over it
+_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=30.0
+)
+
+# OpenAI batch states after which the batch will not progress any further
+BATCH_TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+
 class AIAnalyzer:
+    # Filled with str.format_map; literal braces are doubled
+    _PROMPT_TEMPLATE = """
+        Analyze this sports betting arbitrage opportunity:
+
+        OPPORTUNITY DETAILS:
+        - Profit Percentage: {profit_percentage}%
+        - Expected Profit: ${expected_profit}
+        - Risk Score: {risk_score}/10
+        - Market Type: {market_type}
+        - Total Stake Required: ${total_stake}
+
+        EVENT DETAILS:
+        - Sport: {sport}
+        - Teams: {teams}
+        - Time to Event: {time_to_event_hours:.1f} hours
+        - Event Time: {commence_time}
+
+        BOOKMAKER RELIABILITY:
+        {bookmaker_reliability}
+
+        MARKET CONDITIONS:
+        {market_conditions}
+
+        STAKES DISTRIBUTION:
+        {bookmaker_stakes}
+
+        ODDS:
+        {bookmaker_odds}
+
+        Please provide your analysis in the following JSON format:
+        {{
+            "ai_score": <score from 1-10>,
+            "risk_level": <1-5 scale>,
+            "execution_difficulty": "<easy|medium|hard>",
+            "recommended_action": "<execute|monitor|skip>",
+            "confidence": <0.0-1.0>,
+            "key_factors": ["factor1", "factor2", "factor3"],
+            "warnings": ["warning1", "warning2"],
+            "execution_priority": "<high|medium|low>",
+            "reasoning": "<detailed explanation>"
+        }}
+
+        Consider factors like:
+        - Profit margin vs risk
+        - Bookmaker reliability
+        - Time sensitivity
+        - Market volatility
+        - Execution complexity
+        - Historical performance of similar opportunities
+        """
+
+    # Several opportunities per request: the instructions are sent once for the whole pack
+    _PACKED_PROMPT_TEMPLATE = """
+        Analyze each of these sports betting arbitrage opportunities independently:
+
+        {opportunities}
+
+        Return a JSON object {{"results": [...]}} with exactly one entry per opportunity, each in this format:
+        {{
+            "id": "<id of the opportunity>",
+            "ai_score": <score from 1-10>,
+            "risk_level": <1-5 scale>,
+            "execution_difficulty": "<easy|medium|hard>",
+            "recommended_action": "<execute|monitor|skip>",
+            "confidence": <0.0-1.0>,
+            "key_factors": ["factor1", "factor2", "factor3"],
+            "warnings": ["warning1", "warning2"],
+            "execution_priority": "<high|medium|low>",
+            "reasoning": "<detailed explanation>"
+        }}
+
+        Consider factors like:
+        - Profit margin vs risk
+        - Bookmaker reliability
+        - Time sensitivity
+        - Market volatility
+        - Execution complexity
+        - Historical performance of similar opportunities
+        """
+
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-        self.model = "gpt-4"
+        # Retries are handled by _call_openai, not stacked on top of the SDK's own
+        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0, http_client=_http_client)
+        self.model = settings.AI_MODEL
+        self.max_concurrency = settings.AI_MAX_CONCURRENCY
+        self.pack_size = settings.AI_PACK_SIZE
+        self.request_timeout = settings.AI_REQUEST_TIMEOUT
+        
+        # Reliability scores move slowly; share them across analyses for a couple of minutes
+        self._book_cache = TTLCache(maxsize=512, ttl=120)
+        self._book_locks: Dict[frozenset, asyncio.Lock] = {}
+        
+        # 7-day per-sport market aggregates, keyed by sport
+        self._mc_cache = TTLCache(maxsize=64, ttl=60)
         
     async def analyze_opportunity(self, opportunity_id: str) -> Dict[str, Any]:
         """Analyze an arbitrage opportunity using AI"""
+        now = datetime.now(timezone.utc)
         async with AsyncSessionLocal() as db:
             try:
-                # Get opportunity with related data
-                stmt = select(ArbitrageOpportunity).where(ArbitrageOpportunity.id == opportunity_id)
+                # Get opportunity and its event in a single joined query
+                stmt = self._analysis_rows_stmt().where(ArbitrageOpportunity.id == opportunity_id)
                 result = await db.execute(stmt)
-                opportunity = result.scalar_one_or_none()
+                row = result.one_or_none()
                 
-                if not opportunity:
+                if not row:
                     raise ValueError(f"Opportunity {opportunity_id} not found")
                 
-                # Get event data
-                event_stmt = select(Event).where(Event.id == opportunity.event_id)
-                event_result = await db.execute(event_stmt)
-                event = event_result.scalar_one_or_none()
+                if row.sport is None:
+                    raise ValueError(f"Event {row.event_id} not found")
                 
-                if not event:
-                    raise ValueError(f"Event {opportunity.event_id} not found")
+                analysis_context = await self._build_analysis_context(db, row, now)
                 
-                # Get bookmaker reliability scores
-                bookmaker_scores = await self._get_bookmaker_scores(db, opportunity)
-                
-                # Prepare analysis context
-                analysis_context = {
-                    "opportunity": {
-                        "profit_percentage": opportunity.profit_percentage,
-                        "total_stake": opportunity.total_stake,
-                        "expected_profit": opportunity.expected_profit,
-                        "risk_score": opportunity.risk_score,
-                        "market_type": opportunity.market_type,
-                        "bookmaker_stakes": opportunity.bookmaker_stakes,
-                        "bookmaker_odds": opportunity.bookmaker_odds
-                    },
-                    "event": {
-                        "sport": event.sport,
-                        "teams": event.teams,
-                        "commence_time": event.commence_time.isoformat(),
-                        "time_to_event_hours": (event.commence_time - datetime.utcnow()).total_seconds() / 3600
-                    },
-                    "bookmaker_reliability": bookmaker_scores,
-                    "market_conditions": await self._analyze_market_conditions(db, event)
-                }
-                
-                # Get AI analysis
-                ai_analysis = await self._get_ai_analysis(analysis_context)
+                # Clear-cut opportunities are scored by rules; only ambiguous ones reach the LLM
+                ai_analysis = self._prefilter_analysis(analysis_context)
+                if ai_analysis is None:
+                    ai_analysis = await self._get_ai_analysis(analysis_context)
                 
                 # Update opportunity with AI analysis
-                update_stmt = (
-                    update(ArbitrageOpportunity)
-                    .where(ArbitrageOpportunity.id == opportunity_id)
-                    .values(
-                        ai_score=ai_analysis["ai_score"],
-                        ai_analysis=ai_analysis,
-                        status="analyzed"
-                    )
-                )
-                
-                await db.execute(update_stmt)
-                await db.commit()
+                await self._store_analyses(db, {str(opportunity_id): ai_analysis})
                 
                 logger.info(f"AI analysis completed for opportunity {opportunity_id}")
                 return ai_analysis
@@ -85,60 +196,130 @@ class AIAnalyzer:
                 logger.error(f"Error analyzing opportunity {opportunity_id}: {e}")
                 raise
 
-    async def _get_bookmaker_scores(self, db, opportunity: ArbitrageOpportunity) -> Dict[str, float]:
+    def _analysis_rows_stmt(self):
+        """Select only the opportunity and event columns the analysis reads - no ORM hydration"""
+        return (
+            select(
+                ArbitrageOpportunity.id,
+                ArbitrageOpportunity.event_id,
+                ArbitrageOpportunity.profit_percentage,
+                ArbitrageOpportunity.total_stake,
+                ArbitrageOpportunity.expected_profit,
+                ArbitrageOpportunity.risk_score,
+                ArbitrageOpportunity.market_type,
+                ArbitrageOpportunity.bookmaker_stakes,
+                ArbitrageOpportunity.bookmaker_odds,
+                Event.sport,
+                Event.teams,
+                Event.commence_time
+            )
+            .outerjoin(Event, ArbitrageOpportunity.event_id == Event.id)
+        )
+
+    async def _build_analysis_context(self, db, row, now: datetime) -> Dict[str, Any]:
+        """Collect everything the analysis prompt needs for one row of _analysis_rows_stmt"""
+        # Get bookmaker reliability scores
+        bookmaker_scores = await self._get_bookmaker_scores(db, row)
+        
+        # Prepare analysis context
+        return {
+            "opportunity": {
+                "profit_percentage": row.profit_percentage,
+                "total_stake": row.total_stake,
+                "expected_profit": row.expected_profit,
+                "risk_score": row.risk_score,
+                "market_type": row.market_type,
+                "bookmaker_stakes": row.bookmaker_stakes,
+                "bookmaker_odds": row.bookmaker_odds
+            },
+            "event": {
+                "sport": row.sport,
+                "teams": row.teams,
+                "commence_time": row.commence_time.isoformat(),
+                "time_to_event_hours": (row.commence_time - now).total_seconds() / 3600
+            },
+            "bookmaker_reliability": bookmaker_scores,
+            "market_conditions": await self._analyze_market_conditions(db, row.sport),
+            "analysis_timestamp": now.isoformat()
+        }
+
+    async def _get_bookmaker_scores(self, db, opportunity) -> Dict[str, float]:
         """Get reliability scores for bookmakers involved in the opportunity"""
         bookmakers = list(opportunity.bookmaker_stakes.keys())
-        scores = {}
+        key = frozenset(bookmakers)
         
-        for bookmaker in bookmakers:
-            stmt = select(BookmakerStatus).where(BookmakerStatus.bookmaker == bookmaker)
-            result = await db.execute(stmt)
-            status = result.scalar_one_or_none()
-            
-            if status:
-                scores[bookmaker] = status.reliability_score
-            else:
-                scores[bookmaker] = 5.0  # Default score
+        scores = self._book_cache.get(key)
+        if scores is not None:
+            return dict(scores)
+        
+        # Concurrent misses for the same book set wait for a single query
+        lock = self._book_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            try:
+                scores = self._book_cache.get(key)
+                if scores is None:
+                    # One round-trip for all bookmakers instead of one per bookmaker
+                    stmt = (
+                        select(BookmakerStatus.bookmaker, BookmakerStatus.reliability_score)
+                        .where(BookmakerStatus.bookmaker.in_(bookmakers))
+                    )
+                    result = await db.execute(stmt)
+                    found = dict(result.all())
+                    
+                    scores = {bookmaker: found.get(bookmaker, 5.0) for bookmaker in bookmakers}  # 5.0 is the default score
+                    self._book_cache[key] = scores
+            finally:
+                # Waiters already hold this lock and will find the cache filled; later misses
+                # start a fresh one, so locks never outlive the fill they guard
+                if self._book_locks.get(key) is lock:
+                    del self._book_locks[key]
         
-        return scores
+        return dict(scores)
 
-    async def _analyze_market_conditions(self, db, event: Event) -> Dict[str, Any]:
-        """Analyze current market conditions for the event"""
+    async def _analyze_market_conditions(self, db, sport: str) -> Dict[str, Any]:
+        """Analyze current market conditions for the event's sport"""
+        cached = self._mc_cache.get(sport)
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            # Get recent opportunities for similar events
-            similar_events_stmt = (
-                select(ArbitrageOpportunity)
+            # Aggregate recent opportunities for the sport in SQL - one row back
+            stmt = (
+                select(
+                    func.count(ArbitrageOpportunity.id),
+                    func.avg(ArbitrageOpportunity.profit_percentage),
+                    func.min(ArbitrageOpportunity.profit_percentage),
+                    func.max(ArbitrageOpportunity.profit_percentage)
+                )
                 .join(Event, ArbitrageOpportunity.event_id == Event.id)
                 .where(
                     and_(
-                        Event.sport == event.sport,
-                        ArbitrageOpportunity.detected_at > datetime.utcnow() - timedelta(days=7)
+                        Event.sport == sport,
+                        ArbitrageOpportunity.detected_at > func.now() - timedelta(days=7)
                     )
                 )
-                .limit(50)
             )
             
-            result = await db.execute(similar_events_stmt)
-            recent_opportunities = result.scalars().all()
-            
-            if not recent_opportunities:
-                return {"market_activity": "low", "average_profit": 0, "opportunity_count": 0}
-            
-            # Calculate market metrics
-            profit_percentages = [opp.profit_percentage for opp in recent_opportunities]
-            avg_profit = sum(profit_percentages) / len(profit_percentages)
-            
-            market_activity = "high" if len(recent_opportunities) > 20 else "medium" if len(recent_opportunities) > 10 else "low"
+            result = await db.execute(stmt)
+            opportunity_count, avg_profit, min_profit, max_profit = result.one()
             
-            return {
-                "market_activity": market_activity,
-                "average_profit": round(avg_profit, 2),
-                "opportunity_count": len(recent_opportunities),
-                "profit_range": {
-                    "min": min(profit_percentages),
-                    "max": max(profit_percentages)
+            if not opportunity_count:
+                conditions = {"market_activity": "low", "average_profit": 0, "opportunity_count": 0}
+            else:
+                market_activity = "high" if opportunity_count > 20 else "medium" if opportunity_count > 10 else "low"
+                
+                conditions = {
+                    "market_activity": market_activity,
+                    "average_profit": round(float(avg_profit), 2),
+                    "opportunity_count": opportunity_count,
+                    "profit_range": {
+                        "min": min_profit,
+                        "max": max_profit
+                    }
                 }
-            }
+            
+            self._mc_cache[sport] = conditions
+            return dict(conditions)
             
         except Exception as e:
             logger.error(f"Error analyzing market conditions: {e}")
@@ -147,103 +328,141 @@ class AIAnalyzer:
     async def _get_ai_analysis(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Get AI analysis using OpenAI"""
         try:
-            prompt = self._build_analysis_prompt(context)
+            stream = await self._call_openai({**self._build_chat_request(context), "stream": True})
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert sports betting arbitrage analyst. Analyze the provided opportunity and provide a detailed assessment with scores and recommendations."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,
-                max_tokens=1000
-            )
+            # Stop reading as soon as the analysis object closes; the client timeout only
+            # bounds each read, so cap the whole stream to keep a slow trickle from holding a slot
+            scanner = _JSONObjectScanner()
+            try:
+                async with asyncio.timeout(self.request_timeout):
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if scanner.feed(chunk.choices[0].delta.content):
+                                break
+            finally:
+                await stream.close()
             
             # Parse AI response
-            ai_response = response.choices[0].message.content
+            ai_response = scanner.text()
             analysis = await self._parse_ai_response(ai_response, context)
             
             return analysis
             
+        except TimeoutError:
+            logger.warning(f"AI analysis stream exceeded {self.request_timeout}s, using rule-based analysis")
+            return self._get_default_analysis(context)
         except Exception as e:
             logger.error(f"Error getting AI analysis: {e}")
             # Return default analysis if AI fails
             return self._get_default_analysis(context)
 
-    def _build_analysis_prompt(self, context: Dict[str, Any]) -> str:
-        """Build the analysis prompt for AI"""
-        return f"""
-        Analyze this sports betting arbitrage opportunity:
+    @retry(
+        retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+        wait=wait_random_exponential(multiplier=1, max=30),
+        stop=stop_after_attempt(3),
+        reraise=True
+    )
+    async def _call_openai(self, request: Dict[str, Any], timeout: Optional[float] = None):
+        """Create a chat completion, retrying rate limits, timeouts and 5xx with jittered backoff"""
+        # A stuck request is cut off and reissued rather than holding a concurrency slot
+        client = self.client.with_options(timeout=timeout or self.request_timeout)
+        return await client.chat.completions.create(**request)
 
-        OPPORTUNITY DETAILS:
-        - Profit Percentage: {context['opportunity']['profit_percentage']}%
-        - Expected Profit: ${context['opportunity']['expected_profit']}
-        - Risk Score: {context['opportunity']['risk_score']}/10
-        - Market Type: {context['opportunity']['market_type']}
-        - Total Stake Required: ${context['opportunity']['total_stake']}
-
-        EVENT DETAILS:
-        - Sport: {context['event']['sport']}
-        - Teams: {' vs '.join(context['event']['teams'])}
-        - Time to Event: {context['event']['time_to_event_hours']:.1f} hours
-        - Event Time: {context['event']['commence_time']}
-
-        BOOKMAKER RELIABILITY:
-        {json.dumps(context['bookmaker_reliability'], indent=2)}
-
-        MARKET CONDITIONS:
-        {json.dumps(context['market_conditions'], indent=2)}
-
-        STAKES DISTRIBUTION:
-        {json.dumps(context['opportunity']['bookmaker_stakes'], indent=2)}
+    async def _get_ai_analysis_batch(self, contexts: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Get AI analyses for several opportunities from a single completion"""
+        analyses = {}
+        try:
+            prompt = self._PACKED_PROMPT_TEMPLATE.format_map({
+                "opportunities": _dumps([
+                    {"id": opportunity_id, **context}
+                    for opportunity_id, context in contexts.items()
+                ])
+            })
+            
+            # Generation time grows with the pack, so does the time allowed for it
+            response = await self._call_openai(
+                self._chat_request(prompt, max_tokens=600 * len(contexts)),
+                timeout=self.request_timeout * len(contexts)
+            )
+            
+            results = orjson.loads(response.choices[0].message.content).get("results", [])
+            for result in results:
+                if not isinstance(result, dict):
+                    continue
+                opportunity_id = str(result.get("id"))
+                if opportunity_id not in contexts:
+                    continue
+                # One malformed result must not cost the rest of the pack their analyses
+                try:
+                    analyses[opportunity_id] = self._validate_analysis(result, contexts[opportunity_id])
+                except Exception as e:
+                    logger.warning(f"Invalid packed AI analysis for opportunity {opportunity_id}: {e}")
+            
+        except Exception as e:
+            logger.error(f"Error getting packed AI analysis: {e}")
+        
+        # Opportunities the model skipped or mangled fall back to rules
+        for opportunity_id, context in contexts.items():
+            if opportunity_id not in analyses:
+                analyses[opportunity_id] = self._get_default_analysis(context)
+        
+        return analyses
 
-        ODDS:
-        {json.dumps(context['opportunity']['bookmaker_odds'], indent=2)}
+    def _build_chat_request(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the chat completion request body for one opportunity"""
+        return self._chat_request(self._build_analysis_prompt(context), max_tokens=1000)
 
-        Please provide your analysis in the following JSON format:
-        {{
-            "ai_score": <score from 1-10>,
-            "risk_level": <1-5 scale>,
-            "execution_difficulty": "<easy|medium|hard>",
-            "recommended_action": "<execute|monitor|skip>",
-            "confidence": <0.0-1.0>,
-            "key_factors": ["factor1", "factor2", "factor3"],
-            "warnings": ["warning1", "warning2"],
-            "execution_priority": "<high|medium|low>",
-            "reasoning": "<detailed explanation>"
-        }}
+    def _chat_request(self, prompt: str, max_tokens: int) -> Dict[str, Any]:
+        """Wrap an analysis prompt in a chat completion request body"""
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are an expert sports betting arbitrage analyst. Analyze the provided opportunity and provide a detailed assessment with scores and recommendations."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.3,
+            "max_tokens": max_tokens,
+            # JSON mode: the reply is always a single parseable object
+            "response_format": {"type": "json_object"}
+        }
 
-        Consider factors like:
-        - Profit margin vs risk
-        - Bookmaker reliability
-        - Time sensitivity
-        - Market volatility
-        - Execution complexity
-        - Historical performance of similar opportunities
-        """
+    def _build_analysis_prompt(self, context: Dict[str, Any]) -> str:
+        """Build the analysis prompt for AI"""
+        opportunity = context['opportunity']
+        event = context['event']
+        
+        return self._PROMPT_TEMPLATE.format_map({
+            "profit_percentage": opportunity['profit_percentage'],
+            "expected_profit": opportunity['expected_profit'],
+            "risk_score": opportunity['risk_score'],
+            "market_type": opportunity['market_type'],
+            "total_stake": opportunity['total_stake'],
+            "sport": event['sport'],
+            "teams": ' vs '.join(event['teams']),
+            "time_to_event_hours": event['time_to_event_hours'],
+            "commence_time": event['commence_time'],
+            "bookmaker_reliability": _dumps(context['bookmaker_reliability']),
+            "market_conditions": _dumps(context['market_conditions']),
+            "bookmaker_stakes": _dumps(opportunity['bookmaker_stakes']),
+            "bookmaker_odds": _dumps(opportunity['bookmaker_odds'])
+        })
 
     async def _parse_ai_response(self, ai_response: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Parse and validate AI response"""
         try:
-            # Try to extract JSON from response
-            start_idx = ai_response.find('{')
-            end_idx = ai_response.rfind('}') + 1
+            analysis = orjson.loads(ai_response)
             
-            if start_idx != -1 and end_idx != -1:
-                json_str = ai_response[start_idx:end_idx]
-                analysis = json.loads(json_str)
-                
-                # Validate and sanitize the analysis
-                analysis = self._validate_analysis(analysis, context)
-                return analysis
-            else:
-                raise ValueError("No JSON found in AI response")
+            if not isinstance(analysis, dict):
+                raise ValueError("AI response is not a JSON object")
+            
+            # Validate and sanitize the analysis
+            return self._validate_analysis(analysis, context)
                 
         except Exception as e:
             logger.error(f"Error parsing AI response: {e}")
@@ -262,7 +481,7 @@ class AIAnalyzer:
             "warnings": analysis.get("warnings", [])[:3],  # Limit to 3 warnings
             "execution_priority": analysis.get("execution_priority", "medium"),
             "reasoning": analysis.get("reasoning", "AI analysis completed")[:500],  # Limit length
-            "analysis_timestamp": datetime.utcnow().isoformat(),
+            "analysis_timestamp": context["analysis_timestamp"],
             "model_used": self.model
         }
         
@@ -278,6 +497,19 @@ class AIAnalyzer:
         
         return validated
 
+    def _prefilter_analysis(self, context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Rule-based analysis for clear-cut opportunities, or None when the LLM should decide"""
+        if settings.AI_ALWAYS_LLM:
+            return None
+        
+        analysis = self._get_default_analysis(context)
+        if 2 < analysis["ai_score"] < 9:
+            return None
+        
+        analysis["warnings"] = []
+        analysis["model_used"] = "rule_based_prefilter"
+        return analysis
+
     def _get_default_analysis(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Get default analysis when AI fails"""
         opportunity = context['opportunity']
@@ -314,21 +546,22 @@ class AIAnalyzer:
             "warnings": ["AI analysis unavailable - using rule-based assessment"],
             "execution_priority": "high" if ai_score >= 8 else "medium" if ai_score >= 5 else "low",
             "reasoning": f"Rule-based analysis: {ai_score}/10 score based on profit margin, risk, and timing",
-            "analysis_timestamp": datetime.utcnow().isoformat(),
+            "analysis_timestamp": context["analysis_timestamp"],
             "model_used": "rule_based_fallback"
         }
 
     async def batch_analyze_opportunities(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Analyze multiple opportunities in batch"""
+        now = datetime.now(timezone.utc)
         async with AsyncSessionLocal() as db:
             try:
                 # Get unanalyzed opportunities
                 stmt = (
-                    select(ArbitrageOpportunity)
+                    self._analysis_rows_stmt()
                     .where(
                         and_(
                             ArbitrageOpportunity.status == "detected",
-                            ArbitrageOpportunity.expires_at > datetime.utcnow()
+                            ArbitrageOpportunity.expires_at > now
                         )
                     )
                     .order_by(ArbitrageOpportunity.profit_percentage.desc())
@@ -336,26 +569,199 @@ class AIAnalyzer:
                 )
                 
                 result = await db.execute(stmt)
-                opportunities = result.scalars().all()
-                
-                analyses = []
-                for opportunity in opportunities:
-                    try:
-                        analysis = await self.analyze_opportunity(str(opportunity.id))
-                        analyses.append({
-                            "opportunity_id": str(opportunity.id),
-                            "analysis": analysis
-                        })
-                    except Exception as e:
-                        logger.error(f"Error analyzing opportunity {opportunity.id}: {e}")
-                        continue
-                
-                logger.info(f"Batch analysis completed: {len(analyses)} opportunities analyzed")
-                return analyses
+                contexts = await self._build_analysis_contexts(db, result.all(), now)
                 
             except Exception as e:
                 logger.error(f"Error in batch analysis: {e}")
                 return []
+        
+        analyses, pending = self._split_prefiltered(contexts)
+        pending_ids = list(pending)
+        packs = [
+            {opportunity_id: pending[opportunity_id] for opportunity_id in pending_ids[i:i + self.pack_size]}
+            for i in range(0, len(pending_ids), self.pack_size)
+        ]
+        
+        # Overlap the OpenAI round-trips, capped so we stay inside rate limits
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def analyze_pack(pack: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+            async with semaphore:
+                return await self._get_ai_analysis_batch(pack)
+        
+        results = await asyncio.gather(*[analyze_pack(pack) for pack in packs], return_exceptions=True)
+        
+        for pack, result in zip(packs, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error analyzing opportunities {list(pack)}: {result}")
+                continue
+            analyses.update(result)
+        
+        async with AsyncSessionLocal() as db:
+            try:
+                await self._store_analyses(db, analyses)
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Error storing batch analyses: {e}")
+                return []
+        
+        logger.info(f"Batch analysis completed: {len(analyses)} opportunities analyzed")
+        return [
+            {"opportunity_id": opportunity_id, "analysis": analysis}
+            for opportunity_id, analysis in analyses.items()
+        ]
+
+    async def _build_analysis_contexts(self, db, rows, now: datetime) -> Dict[str, Dict[str, Any]]:
+        """Analysis contexts keyed by opportunity id, from _analysis_rows_stmt rows"""
+        contexts = {}
+        for row in rows:
+            if row.sport is None:
+                logger.warning(f"Event {row.event_id} not found, skipping opportunity {row.id}")
+                continue
+            contexts[str(row.id)] = await self._build_analysis_context(db, row, now)
+        return contexts
+
+    def _split_prefiltered(self, contexts: Dict[str, Dict[str, Any]]):
+        """Split contexts into rule-scored analyses and the ones still needing the LLM"""
+        analyses = {}
+        pending = {}
+        for opportunity_id, context in contexts.items():
+            prefiltered = self._prefilter_analysis(context)
+            if prefiltered is None:
+                pending[opportunity_id] = context
+            else:
+                analyses[opportunity_id] = prefiltered
+        return analyses, pending
+
+    async def batch_analyze_opportunities_offline(self, opportunity_ids: List[str]) -> List[Dict[str, Any]]:
+        """Analyze opportunities through the OpenAI Batch API (cheaper, results within 24h)"""
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as db:
+            opportunity_uuids = [uuid.UUID(str(opportunity_id)) for opportunity_id in opportunity_ids]
+            result = await db.execute(
+                self._analysis_rows_stmt().where(ArbitrageOpportunity.id.in_(opportunity_uuids))
+            )
+            contexts = await self._build_analysis_contexts(db, result.all(), now)
+        
+        if not contexts:
+            return []
+        
+        analyses, pending = self._split_prefiltered(contexts)
+        
+        responses = {}
+        if pending:
+            # One JSONL line per opportunity, matched back to it by custom_id
+            batch_input = b"\n".join(
+                orjson.dumps({
+                    "custom_id": opportunity_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self._build_chat_request(context)
+                })
+                for opportunity_id, context in pending.items()
+            )
+            
+            try:
+                input_file = await self.client.files.create(
+                    file=("opportunity_analysis.jsonl", batch_input),
+                    purpose="batch"
+                )
+                batch = await self.client.batches.create(
+                    input_file_id=input_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h"
+                )
+                logger.info(f"Submitted OpenAI batch {batch.id} for {len(pending)} opportunities")
+                
+                batch = await self._wait_for_batch(batch.id)
+                
+                if batch.status == "completed" and batch.output_file_id:
+                    output = await self.client.files.content(batch.output_file_id)
+                    for line in output.text.splitlines():
+                        if line.strip():
+                            record = orjson.loads(line)
+                            responses[record["custom_id"]] = record
+                else:
+                    logger.error(f"OpenAI batch {batch.id} ended with status {batch.status}")
+                    
+            except Exception as e:
+                logger.error(f"Error running OpenAI batch analysis: {e}")
+                responses = {}
+        
+        # Failed or missing lines fall back to the rule-based assessment
+        for opportunity_id, context in pending.items():
+            record = responses.get(opportunity_id)
+            response = (record or {}).get("response") or {}
+            
+            if response.get("status_code") == 200:
+                ai_response = response["body"]["choices"][0]["message"]["content"]
+                analyses[opportunity_id] = await self._parse_ai_response(ai_response, context)
+            else:
+                analyses[opportunity_id] = self._get_default_analysis(context)
+        
+        async with AsyncSessionLocal() as db:
+            try:
+                await self._store_analyses(db, analyses)
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Error storing batch analyses: {e}")
+                raise
+        
+        logger.info(f"Offline batch analysis completed: {len(analyses)} opportunities analyzed")
+        return [
+            {"opportunity_id": opportunity_id, "analysis": analysis}
+            for opportunity_id, analysis in analyses.items()
+        ]
+
+    async def _wait_for_batch(self, batch_id: str):
+        """Poll an OpenAI batch until it completes, fails, expires or is cancelled"""
+        while True:
+            batch = await self.client.batches.retrieve(batch_id)
+            if batch.status in BATCH_TERMINAL_STATUSES:
+                return batch
+            await asyncio.sleep(settings.AI_BATCH_POLL_INTERVAL)
+
+    async def _store_analyses(self, db, analyses: Dict[str, Dict[str, Any]], commit: bool = True):
+        """Write many analyses back with a single UPDATE ... FROM (VALUES ...)"""
+        if not analyses:
+            return
+        
+        analysis_rows = values(
+            column("id", ArbitrageOpportunity.id.type),
+            column("ai_score", ArbitrageOpportunity.ai_score.type),
+            column("ai_analysis", ArbitrageOpportunity.ai_analysis.type),
+            name="analysis_rows"
+        ).data([
+            (uuid.UUID(opportunity_id), analysis["ai_score"], analysis)
+            for opportunity_id, analysis in analyses.items()
+        ])
+        
+        stmt = (
+            update(ArbitrageOpportunity)
+            .where(
+                and_(
+                    ArbitrageOpportunity.id == analysis_rows.c.id,
+                    # Offline batches can land hours later; never revive expired or executed rows
+                    ArbitrageOpportunity.status.in_(["detected", "analyzed"])
+                )
+            )
+            .values(
+                ai_score=analysis_rows.c.ai_score,
+                ai_analysis=analysis_rows.c.ai_analysis,
+                status="analyzed"
+            )
+        )
+        
+        await db.execute(stmt)
+        if commit:
+            await db.commit()
+
+    async def aclose(self):
+        """Close the shared OpenAI HTTP connection pool"""
+        try:
+            await _http_client.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing OpenAI HTTP client: {e}")
 
 # Singleton instance
 ai_analyzer = AIAnalyzer()
@@ -1,16 +1,77 @@
 import asyncio
-from typing import Dict, List, Tuple, Optional, Any
-from datetime import datetime, timedelta
+from typing import Dict, List, Set, Tuple, Any
+from datetime import datetime, timedelta, timezone
 import logging
 import math
+from collections import defaultdict
+import numpy as np
 from app.core.config import settings
-from app.models.events import Event, OddsSnapshot, ArbitrageOpportunity
+from app.models.events import Event, OddsSnapshot, ArbitrageOpportunity, MarketArbCandidate
 from app.core.database import AsyncSessionLocal
-from sqlalchemy import select, and_, desc
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, and_, desc, func, tuple_
 
 logger = logging.getLogger(__name__)
 
+# Base stake the suggested stakes are scaled to
+BASE_TOTAL_STAKE = 1000
+
+# Quoted odds carry 2-3 decimals, well within float32's ~7 significant digits
+ODDS_DTYPE = np.float32
+
+# Rows fetched per round-trip while streaming detection input
+DETECTION_STREAM_BATCH_SIZE = 200
+
+def _calc_arbs_vectorized(odds: np.ndarray, outcome_mask: np.ndarray):
+    """Best odds, implied totals, profit and stake shares for a padded (markets, bookmakers, outcomes) tensor"""
+    best_idx = odds.argmax(axis=1)  # (M, O) index of the bookmaker offering the best price
+    best = odds.max(axis=1)         # (M, O)
+    
+    priced = best > 0
+    # Every real outcome of the market must be priced somewhere, and a market needs two outcomes
+    complete = np.all(priced | ~outcome_mask, axis=1) & (outcome_mask.sum(axis=1) >= 2)
+    
+    implied = np.divide(1.0, best, out=np.zeros_like(best), where=outcome_mask & priced)
+    total = implied.sum(axis=1)
+    
+    safe_total = np.where(total > 0, total, 1.0)
+    profit_pct = (1.0 - total) / safe_total * 100
+    stake_share = implied / safe_total[:, None]
+    
+    return best_idx, best, total, profit_pct, stake_share, complete
+
+# Sports whose prices move fast enough to add risk
+VOLATILE_SPORTS = frozenset({'tennis', 'basketball_nba'})
+
+def _risk_core(time_to_event_hours: float, num_bookmakers: int, oldest_odds_age_minutes: float, volatile_sport: bool) -> float:
+    """Risk score (1-10) from plain numbers; no datetime or ORM access"""
+    risk_score = 5.0  # Base risk
+    
+    # Time to event factor
+    if time_to_event_hours < 1:  # Less than 1 hour
+        risk_score += 2
+    elif time_to_event_hours < 24:  # Less than 24 hours
+        risk_score += 1
+    elif time_to_event_hours > 168:  # More than 1 week
+        risk_score += 1
+    
+    # Number of bookmakers factor
+    if num_bookmakers >= 4:
+        risk_score -= 1
+    elif num_bookmakers == 2:
+        risk_score += 1
+    
+    # Odds age factor
+    if oldest_odds_age_minutes > 10:
+        risk_score += 1
+    if oldest_odds_age_minutes > 30:
+        risk_score += 2
+    
+    # Sport-specific risk
+    if volatile_sport:
+        risk_score += 0.5  # More volatile sports
+    
+    return min(max(risk_score, 1.0), 10.0)
+
 class ArbitrageDetector:
     def __init__(self):
         self.min_profit_percentage = settings.MIN_ARBITRAGE_PERCENTAGE
@@ -25,36 +86,39 @@ class ArbitrageDetector:
         
         async with AsyncSessionLocal() as db:
             try:
-                # Get recent events with odds
-                cutoff_time = datetime.utcnow() - timedelta(minutes=10)
+                # One timestamp for the whole cycle
+                now = datetime.now(timezone.utc)
                 
-                stmt = (
-                    select(Event)
-                    .where(
-                        and_(
-                            Event.status == "upcoming",
-                            Event.commence_time > datetime.utcnow(),
-                            Event.commence_time < datetime.utcnow() + timedelta(days=7)
-                        )
-                    )
-                    .order_by(Event.commence_time)
-                    .limit(100)
-                )
+                # Only markets whose best prices already imply an arbitrage are worth loading
+                candidate_markets = {}
+                candidate_result = await db.execute(self._candidate_markets_stmt(now))
+                for event_id, market_type in candidate_result:
+                    candidate_markets.setdefault(event_id, set()).add(market_type)
+                
+                if not candidate_markets:
+                    logger.info("Arbitrage detection completed: no candidate markets")
+                    return []
                 
-                result = await db.execute(stmt)
-                events = result.scalars().all()
+                # Candidate events and the latest snapshot per bookmaker in a single query,
+                # streamed so each event is analyzed as soon as its rows arrive
+                stmt = self._latest_odds_stmt(now, list(candidate_markets))
+                stmt = stmt.execution_options(yield_per=DETECTION_STREAM_BATCH_SIZE)
+                result = await db.stream(stmt)
                 
-                for event in events:
-                    try:
-                        event_opportunities = await self._analyze_event_for_arbitrage(db, event)
-                        opportunities.extend(event_opportunities)
-                    except Exception as e:
-                        logger.error(f"Error analyzing event {event.id}: {e}")
-                        continue
+                snapshots = []
+                async for row in result:
+                    # Rows are ordered by event, so a new id means the previous event is complete
+                    if snapshots and row.Event.id != snapshots[0].Event.id:
+                        opportunities.extend(self._analyze_event_rows(snapshots, candidate_markets, now))
+                        snapshots = []
+                    snapshots.append(row)
+                
+                if snapshots:
+                    opportunities.extend(self._analyze_event_rows(snapshots, candidate_markets, now))
                 
                 # Store detected opportunities
                 if opportunities:
-                    await self._store_opportunities(db, opportunities)
+                    await self._store_opportunities(db, opportunities, now)
                 
                 logger.info(f"Arbitrage detection completed: {len(opportunities)} opportunities found")
                 return opportunities
@@ -63,202 +127,199 @@ class ArbitrageDetector:
                 logger.error(f"Error in arbitrage detection: {e}")
                 return []
 
-    async def _analyze_event_for_arbitrage(self, db, event: Event) -> List[Dict[str, Any]]:
-        """Analyze a single event for arbitrage opportunities"""
-        opportunities = []
+    def _analyze_event_rows(self, snapshots: List, candidate_markets: Dict, now: datetime) -> List[Dict[str, Any]]:
+        """Analyze one event's rows, logging rather than aborting the cycle on failure"""
+        event = snapshots[0].Event
+        try:
+            return self._analyze_event_for_arbitrage(event, snapshots, candidate_markets[event.id], now)
+        except Exception as e:
+            logger.error(f"Error analyzing event {event.id}: {e}")
+            return []
+
+    def _candidate_markets_stmt(self, now: datetime):
+        """(event_id, market_type) of upcoming markets whose best prices clear the profit threshold"""
+        # profit% = (1 - total) / total * 100, so profit >= min  <=>  total <= 1 / (1 + min / 100)
+        max_implied_total = 1 / (1 + self.min_profit_percentage / 100)
         
-        # Get latest odds for this event
-        stmt = (
-            select(OddsSnapshot)
+        return (
+            select(MarketArbCandidate.event_id, MarketArbCandidate.market_type)
+            .join(Event, Event.id == MarketArbCandidate.event_id)
             .where(
                 and_(
-                    OddsSnapshot.event_id == event.id,
+                    MarketArbCandidate.min_implied_total <= max_implied_total,
+                    MarketArbCandidate.updated_at > now - timedelta(minutes=settings.ODDS_MAX_AGE_MINUTES),
+                    Event.status == "upcoming",
+                    Event.commence_time > now,
+                    Event.commence_time < now + timedelta(days=7)
+                )
+            )
+        )
+
+    def _latest_odds_stmt(self, now: datetime, event_ids: List):
+        """Candidate events joined to each bookmaker's most recent active snapshot"""
+        ranked_snapshots = (
+            select(
+                OddsSnapshot.event_id,
+                OddsSnapshot.bookmaker,
+                OddsSnapshot.odds_data,
+                OddsSnapshot.captured_at,
+                func.row_number().over(
+                    partition_by=[OddsSnapshot.event_id, OddsSnapshot.bookmaker],
+                    order_by=desc(OddsSnapshot.captured_at)
+                ).label("snapshot_rank")
+            )
+            .where(
+                and_(
+                    OddsSnapshot.event_id.in_(event_ids),
                     OddsSnapshot.is_active == True,
-                    OddsSnapshot.captured_at > datetime.utcnow() - timedelta(minutes=30)
+                    OddsSnapshot.captured_at > now - timedelta(minutes=settings.ODDS_MAX_AGE_MINUTES)
                 )
             )
-            .order_by(desc(OddsSnapshot.captured_at))
+            .subquery()
         )
         
-        result = await db.execute(stmt)
-        odds_snapshots = result.scalars().all()
+        return (
+            select(Event, ranked_snapshots.c.bookmaker, ranked_snapshots.c.odds_data, ranked_snapshots.c.captured_at)
+            .join(ranked_snapshots, ranked_snapshots.c.event_id == Event.id)
+            .where(ranked_snapshots.c.snapshot_rank == 1)
+            .order_by(Event.commence_time, Event.id)
+        )
+
+    def _analyze_event_for_arbitrage(self, event: Event, odds_snapshots: List, market_types: Set[str], now: datetime) -> List[Dict[str, Any]]:
+        """Analyze a single event's latest snapshot per bookmaker for arbitrage opportunities"""
+        opportunities = []
         
         if len(odds_snapshots) < 2:
             return opportunities
         
-        # Group odds by market type
-        odds_by_market = {}
+        # Group odds by market type as flat (bookmaker, odds, timestamp) quotes
+        odds_by_market = defaultdict(list)
         for snapshot in odds_snapshots:
+            captured_ts = snapshot.captured_at.timestamp()  # epoch seconds, once per snapshot
             for market_type, market_odds in snapshot.odds_data.items():
-                if market_type not in odds_by_market:
-                    odds_by_market[market_type] = {}
-                
-                odds_by_market[market_type][snapshot.bookmaker] = {
-                    'odds': market_odds,
-                    'timestamp': snapshot.captured_at
-                }
+                if market_type in market_types:
+                    odds_by_market[market_type].append((snapshot.bookmaker, market_odds, captured_ts))
         
-        # Analyze each market for arbitrage
-        for market_type, market_data in odds_by_market.items():
-            if len(market_data) >= 2:  # Need at least 2 bookmakers
-                arb_opportunity = await self._calculate_arbitrage(
-                    event, market_type, market_data
-                )
-                if arb_opportunity:
-                    opportunities.append(arb_opportunity)
+        # Analyze every market of the event in one vectorized pass
+        markets = {
+            market_type: market_data
+            for market_type, market_data in odds_by_market.items()
+            if len(market_data) >= 2  # Need at least 2 bookmakers
+        }
+        if markets:
+            opportunities.extend(self._calculate_arbitrage(event, markets, now))
         
         return opportunities
 
-    async def _calculate_arbitrage(self, event: Event, market_type: str, market_data: Dict) -> Optional[Dict[str, Any]]:
-        """Calculate arbitrage for a specific market"""
+    def _calculate_arbitrage(self, event: Event, markets: Dict[str, List[Tuple]], now: datetime) -> List[Dict[str, Any]]:
+        """Calculate arbitrage for all markets of an event"""
+        opportunities = []
+        
         try:
-            # Get all possible outcomes for this market
-            all_outcomes = set()
-            for bookmaker_data in market_data.values():
-                all_outcomes.update(bookmaker_data['odds'].keys())
-            
-            if len(all_outcomes) < 2:
-                return None
-            
-            # Find best odds for each outcome
-            best_odds = {}
-            best_bookmakers = {}
-            
-            for outcome in all_outcomes:
-                best_odd = 0
-                best_bookmaker = None
-                
-                for bookmaker, bookmaker_data in market_data.items():
-                    odds = bookmaker_data['odds'].get(outcome, 0)
-                    if odds > best_odd:
-                        best_odd = odds
-                        best_bookmaker = bookmaker
-                
-                if best_odd > 0:
-                    best_odds[outcome] = best_odd
-                    best_bookmakers[outcome] = best_bookmaker
-            
-            if len(best_odds) != len(all_outcomes):
-                return None
+            # Pack the odds into a zero-padded (markets, bookmakers, outcomes) tensor
+            market_types = list(markets)
+            market_outcomes = [
+                list(dict.fromkeys(outcome for _, market_odds, _ in market_data for outcome in market_odds))
+                for market_data in markets.values()
+            ]
             
-            # Calculate arbitrage
-            implied_probabilities = {outcome: 1/odds for outcome, odds in best_odds.items()}
-            total_implied_probability = sum(implied_probabilities.values())
+            num_bookmakers = max(len(market_data) for market_data in markets.values())
+            num_outcomes = max(len(outcomes) for outcomes in market_outcomes)
             
-            # Check if arbitrage exists
-            if total_implied_probability >= 1.0:
-                return None
+            odds = np.zeros((len(market_types), num_bookmakers, num_outcomes), dtype=ODDS_DTYPE)
+            outcome_mask = np.zeros((len(market_types), num_outcomes), dtype=bool)
             
-            profit_percentage = ((1 - total_implied_probability) / total_implied_probability) * 100
+            for m, market_data in enumerate(markets.values()):
+                outcome_index = {outcome: o for o, outcome in enumerate(market_outcomes[m])}
+                outcome_mask[m, :len(outcome_index)] = True
+                for b, (_, market_odds, _) in enumerate(market_data):
+                    for outcome, price in market_odds.items():
+                        odds[m, b, outcome_index[outcome]] = price
             
-            if profit_percentage < self.min_profit_percentage:
-                return None
+            best_idx, best, total, profit_pct, stake_share, complete = _calc_arbs_vectorized(odds, outcome_mask)
             
-            # Calculate optimal stakes
-            total_stake = 1000  # Base stake for calculation
-            stakes = {}
+            # Only markets that clear the threshold go back to Python objects
+            arbitrage = complete & (total < 1.0) & (profit_pct >= self.min_profit_percentage)
             
-            for outcome, probability in implied_probabilities.items():
-                stake = (probability / total_implied_probability) * total_stake
-                stakes[outcome] = round(stake, 2)
-            
-            # Calculate expected profit
-            expected_profit = total_stake * (profit_percentage / 100)
-            
-            # Build opportunity data
-            opportunity = {
-                'event_id': event.id,
-                'market_type': market_type,
-                'profit_percentage': round(profit_percentage, 2),
-                'total_stake': total_stake,
-                'expected_profit': round(expected_profit, 2),
-                'bookmaker_stakes': {},
-                'bookmaker_odds': {},
-                'risk_score': await self._calculate_risk_score(event, market_data),
-                'expires_at': datetime.utcnow() + timedelta(minutes=15)  # Opportunities expire quickly
-            }
-            
-            # Organize stakes and odds by bookmaker
-            for outcome in all_outcomes:
-                bookmaker = best_bookmakers[outcome]
-                if bookmaker not in opportunity['bookmaker_stakes']:
-                    opportunity['bookmaker_stakes'][bookmaker] = {}
-                    opportunity['bookmaker_odds'][bookmaker] = {}
+            for m in np.flatnonzero(arbitrage):
+                market_type = market_types[m]
+                total_stake = BASE_TOTAL_STAKE
+                profit_percentage = float(profit_pct[m])
                 
-                opportunity['bookmaker_stakes'][bookmaker][outcome] = stakes[outcome]
-                opportunity['bookmaker_odds'][bookmaker][outcome] = best_odds[outcome]
-            
-            return opportunity
+                # Calculate expected profit
+                expected_profit = total_stake * (profit_percentage / 100)
+                
+                # Build opportunity data
+                opportunity = {
+                    'event_id': event.id,
+                    'market_type': market_type,
+                    'profit_percentage': round(profit_percentage, 2),
+                    'total_stake': total_stake,
+                    'expected_profit': round(expected_profit, 2),
+                    'bookmaker_stakes': {},
+                    'bookmaker_odds': {},
+                    'risk_score': self._calculate_risk_score(event, markets[market_type], now),
+                    'expires_at': now + timedelta(minutes=15)  # Opportunities expire quickly
+                }
+                
+                # Organize stakes and odds by bookmaker
+                for o, outcome in enumerate(market_outcomes[m]):
+                    bookmaker, market_odds, _ = markets[market_type][best_idx[m, o]]
+                    if bookmaker not in opportunity['bookmaker_stakes']:
+                        opportunity['bookmaker_stakes'][bookmaker] = {}
+                        opportunity['bookmaker_odds'][bookmaker] = {}
+                    
+                    opportunity['bookmaker_stakes'][bookmaker][outcome] = round(float(stake_share[m, o]) * total_stake, 2)
+                    # Quoted price, not its float32 approximation
+                    opportunity['bookmaker_odds'][bookmaker][outcome] = market_odds[outcome]
+                
+                opportunities.append(opportunity)
             
         except Exception as e:
             logger.error(f"Error calculating arbitrage: {e}")
-            return None
+        
+        return opportunities
 
-    async def _calculate_risk_score(self, event: Event, market_data: Dict) -> float:
+    def _calculate_risk_score(self, event: Event, market_data: List[Tuple], now: datetime) -> float:
         """Calculate risk score for an opportunity (1-10 scale)"""
-        risk_score = 5.0  # Base risk
-        
         try:
-            # Time to event factor
-            time_to_event = (event.commence_time - datetime.utcnow()).total_seconds() / 3600
-            if time_to_event < 1:  # Less than 1 hour
-                risk_score += 2
-            elif time_to_event < 24:  # Less than 24 hours
-                risk_score += 1
-            elif time_to_event > 168:  # More than 1 week
-                risk_score += 1
-            
-            # Number of bookmakers factor
-            num_bookmakers = len(market_data)
-            if num_bookmakers >= 4:
-                risk_score -= 1
-            elif num_bookmakers == 2:
-                risk_score += 1
+            now_ts = now.timestamp()
+            time_to_event = (event.commence_time.timestamp() - now_ts) / 3600
             
-            # Odds age factor
-            oldest_odds_age = 0
-            for bookmaker_data in market_data.values():
-                age_minutes = (datetime.utcnow() - bookmaker_data['timestamp']).total_seconds() / 60
-                oldest_odds_age = max(oldest_odds_age, age_minutes)
+            # Oldest snapshot decides; plain float math on epoch seconds, no timedelta objects
+            oldest_timestamp = min(timestamp for _, _, timestamp in market_data)
+            oldest_odds_age = max((now_ts - oldest_timestamp) / 60, 0)
             
-            if oldest_odds_age > 10:
-                risk_score += 1
-            if oldest_odds_age > 30:
-                risk_score += 2
-            
-            # Sport-specific risk
-            if event.sport in ['tennis', 'basketball_nba']:
-                risk_score += 0.5  # More volatile sports
-            
-            return min(max(risk_score, 1.0), 10.0)
+            return _risk_core(time_to_event, len(market_data), oldest_odds_age, event.sport in VOLATILE_SPORTS)
             
         except Exception as e:
             logger.error(f"Error calculating risk score: {e}")
             return 5.0
 
-    async def _store_opportunities(self, db, opportunities: List[Dict[str, Any]]):
+    async def _store_opportunities(self, db, opportunities: List[Dict[str, Any]], now: datetime):
         """Store detected arbitrage opportunities"""
         try:
-            for opp_data in opportunities:
-                # Check if similar opportunity already exists
-                stmt = (
-                    select(ArbitrageOpportunity)
-                    .where(
-                        and_(
-                            ArbitrageOpportunity.event_id == opp_data['event_id'],
-                            ArbitrageOpportunity.market_type == opp_data['market_type'],
-                            ArbitrageOpportunity.status.in_(['detected', 'analyzed']),
-                            ArbitrageOpportunity.detected_at > datetime.utcnow() - timedelta(hours=1)
-                        )
+            # Check which (event, market) pairs already have a recent opportunity in one query
+            keys = {(opp_data['event_id'], opp_data['market_type']) for opp_data in opportunities}
+            stmt = (
+                select(ArbitrageOpportunity.event_id, ArbitrageOpportunity.market_type)
+                .where(
+                    and_(
+                        tuple_(ArbitrageOpportunity.event_id, ArbitrageOpportunity.market_type).in_(keys),
+                        ArbitrageOpportunity.status.in_(['detected', 'analyzed']),
+                        ArbitrageOpportunity.detected_at > now - timedelta(hours=1)
                     )
                 )
-                
-                result = await db.execute(stmt)
-                existing = result.scalar_one_or_none()
-                
-                if not existing:
-                    opportunity = ArbitrageOpportunity(**opp_data)
-                    db.add(opportunity)
+            )
+            
+            result = await db.execute(stmt)
+            existing = {(row.event_id, row.market_type) for row in result}
+            
+            db.add_all([
+                ArbitrageOpportunity(**opp_data)
+                for opp_data in opportunities
+                if (opp_data['event_id'], opp_data['market_type']) not in existing
+            ])
             
             await db.commit()
             
@@ -267,7 +328,7 @@ class ArbitrageDetector:
             logger.error(f"Error storing opportunities: {e}")
             raise
 
-    async def calculate_kelly_stakes(self, opportunity: Dict[str, Any], bankroll: float) -> Dict[str, Any]:
+    def calculate_kelly_stakes(self, opportunity: Dict[str, Any], bankroll: float) -> Dict[str, Any]:
         """Calculate optimal stakes using Kelly Criterion"""
         try:
             total_stake = 0
@@ -1,6 +1,9 @@
 import asyncio
+import heapq
+import itertools
 import logging
-from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from datetime import datetime, timedelta, timezone
 from app.core.config import settings
 from app.services.odds_collector import odds_collector
 from app.services.arbitrage_detector import arbitrage_detector
@@ -8,10 +11,29 @@ from app.services.ai_analyzer import ai_analyzer
 
 logger = logging.getLogger(__name__)
 
+# Rows removed per DELETE when pruning old odds snapshots
+SNAPSHOT_CLEANUP_BATCH_SIZE = 10000
+
 class BackgroundTaskManager:
     def __init__(self):
         self.tasks = []
         self.running = False
+        
+        # name -> (coroutine function, interval, retry delay after an error), in seconds
+        self._jobs = {
+            "odds_collection": (odds_collector.collect_all_odds, settings.ODDS_COLLECTION_INTERVAL, 60),
+            "arbitrage_detection": (arbitrage_detector.detect_arbitrage_opportunities, settings.ARBITRAGE_DETECTION_INTERVAL, 30),
+            "ai_analysis": (self._ai_analysis, 60, 120),
+            "cleanup": (self._cleanup, 3600, 1800),
+        }
+        
+        # Min-heap of (run_at, sequence, name, generation); stale generations are skipped
+        self._queue: List[Tuple[float, int, str, int]] = []
+        self._sequence = itertools.count()
+        self._generations = dict.fromkeys(self._jobs, 0)
+        self._running_jobs: Dict[str, asyncio.Task] = {}
+        self._rerun = set()
+        self._wakeup = asyncio.Event()
     
     async def start_all_tasks(self):
         """Start all background tasks"""
@@ -22,99 +44,109 @@ class BackgroundTaskManager:
         self.running = True
         logger.info("Starting background tasks...")
         
-        # Start odds collection task
-        odds_task = asyncio.create_task(self._odds_collection_loop())
-        self.tasks.append(odds_task)
-        
-        # Start arbitrage detection task
-        arbitrage_task = asyncio.create_task(self._arbitrage_detection_loop())
-        self.tasks.append(arbitrage_task)
-        
-        # Start AI analysis task
-        ai_task = asyncio.create_task(self._ai_analysis_loop())
-        self.tasks.append(ai_task)
+        for name in self._jobs:
+            self._schedule(name, 0)
         
-        # Start cleanup task
-        cleanup_task = asyncio.create_task(self._cleanup_loop())
-        self.tasks.append(cleanup_task)
+        # One scheduler drives every job instead of a sleeping loop per job
+        scheduler_task = asyncio.create_task(self._scheduler_loop())
+        self.tasks.append(scheduler_task)
         
-        logger.info(f"Started {len(self.tasks)} background tasks")
+        logger.info(f"Started background scheduler with {len(self._jobs)} jobs")
     
     async def stop_all_tasks(self):
         """Stop all background tasks"""
         self.running = False
         logger.info("Stopping background tasks...")
         
-        for task in self.tasks:
+        tasks = self.tasks + list(self._running_jobs.values())
+        for task in tasks:
             task.cancel()
         
         # Wait for tasks to complete
-        if self.tasks:
-            await asyncio.gather(*self.tasks, return_exceptions=True)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
         
         self.tasks.clear()
+        self._running_jobs.clear()
+        self._queue.clear()
+        self._rerun.clear()
         logger.info("All background tasks stopped")
     
-    async def _odds_collection_loop(self):
-        """Background task for collecting odds data"""
-        logger.info("Starting odds collection loop")
+    def _schedule(self, name: str, delay: float):
+        """Queue a job to run after delay seconds, replacing any earlier schedule for it"""
+        self._generations[name] += 1
+        run_at = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self._queue, (run_at, next(self._sequence), name, self._generations[name]))
+        self._wakeup.set()
+    
+    def _trigger(self, name: str):
+        """Run a job as soon as possible, or straight after its current run"""
+        if name in self._running_jobs:
+            self._rerun.add(name)
+        else:
+            self._schedule(name, 0)
+    
+    async def _scheduler_loop(self):
+        """Start jobs as they fall due and sleep until the next one"""
+        logger.info("Starting background scheduler")
+        loop = asyncio.get_running_loop()
         
-        while self.running:
-            try:
-                await odds_collector.collect_all_odds()
-                await asyncio.sleep(settings.ODDS_COLLECTION_INTERVAL)
-            except asyncio.CancelledError:
-                logger.info("Odds collection task cancelled")
-                break
-            except Exception as e:
-                logger.error(f"Error in odds collection loop: {e}")
-                await asyncio.sleep(60)  # Wait before retrying
+        try:
+            while self.running:
+                self._wakeup.clear()
+                now = loop.time()
+                
+                while self._queue and self._queue[0][0] <= now:
+                    _, _, name, generation = heapq.heappop(self._queue)
+                    if generation == self._generations[name] and name not in self._running_jobs:
+                        self._running_jobs[name] = asyncio.create_task(self._run_job(name))
+                
+                timeout = self._queue[0][0] - now if self._queue else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            logger.info("Background scheduler cancelled")
     
-    async def _arbitrage_detection_loop(self):
-        """Background task for detecting arbitrage opportunities"""
-        logger.info("Starting arbitrage detection loop")
+    async def _run_job(self, name: str):
+        """Run one job and queue its next run once it finishes"""
+        func, interval, retry_delay = self._jobs[name]
         
-        while self.running:
-            try:
-                await arbitrage_detector.detect_arbitrage_opportunities()
-                await asyncio.sleep(settings.ARBITRAGE_DETECTION_INTERVAL)
-            except asyncio.CancelledError:
-                logger.info("Arbitrage detection task cancelled")
-                break
-            except Exception as e:
-                logger.error(f"Error in arbitrage detection loop: {e}")
-                await asyncio.sleep(30)  # Wait before retrying
+        try:
+            await func()
+            delay = interval
+        except asyncio.CancelledError:
+            logger.info(f"{name} task cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Error in {name} task: {e}")
+            delay = retry_delay
+        finally:
+            self._running_jobs.pop(name, None)
+        
+        if not self.running:
+            return
+        
+        if name in self._rerun:
+            self._rerun.discard(name)
+            delay = 0
+        self._schedule(name, delay)
+        
+        # Fresh odds make detection due now rather than at its next interval
+        if name == "odds_collection" and odds_collector.new_odds_event.is_set():
+            odds_collector.new_odds_event.clear()
+            self._trigger("arbitrage_detection")
     
-    async def _ai_analysis_loop(self):
+    async def _ai_analysis(self):
         """Background task for AI analysis of opportunities"""
-        logger.info("Starting AI analysis loop")
-        
-        while self.running:
-            try:
-                await ai_analyzer.batch_analyze_opportunities(limit=5)
-                await asyncio.sleep(60)  # Run every minute
-            except asyncio.CancelledError:
-                logger.info("AI analysis task cancelled")
-                break
-            except Exception as e:
-                logger.error(f"Error in AI analysis loop: {e}")
-                await asyncio.sleep(120)  # Wait before retrying
+        await ai_analyzer.batch_analyze_opportunities(limit=5)
     
-    async def _cleanup_loop(self):
+    async def _cleanup(self):
         """Background task for cleaning up old data"""
-        logger.info("Starting cleanup loop")
-        
-        while self.running:
-            try:
-                await self._cleanup_expired_opportunities()
-                await self._cleanup_old_odds_snapshots()
-                await asyncio.sleep(3600)  # Run every hour
-            except asyncio.CancelledError:
-                logger.info("Cleanup task cancelled")
-                break
-            except Exception as e:
-                logger.error(f"Error in cleanup loop: {e}")
-                await asyncio.sleep(1800)  # Wait before retrying
+        await self._cleanup_expired_opportunities()
+        await self._cleanup_old_odds_snapshots()
+        await self._cleanup_stale_arb_candidates()
     
     async def _cleanup_expired_opportunities(self):
         """Clean up expired arbitrage opportunities"""
@@ -129,7 +161,7 @@ class BackgroundTaskManager:
                     update(ArbitrageOpportunity)
                     .where(
                         and_(
-                            ArbitrageOpportunity.expires_at <= datetime.utcnow(),
+                            ArbitrageOpportunity.expires_at <= datetime.now(timezone.utc),
                             ArbitrageOpportunity.status.in_(["detected", "analyzed"])
                         )
                     )
@@ -150,23 +182,59 @@ class BackgroundTaskManager:
         """Clean up old odds snapshots"""
         from app.core.database import AsyncSessionLocal
         from app.models.events import OddsSnapshot
-        from sqlalchemy import delete
+        from sqlalchemy import delete, select
         
         async with AsyncSessionLocal() as db:
             try:
                 # Delete odds snapshots older than 7 days
-                cutoff_date = datetime.utcnow() - timedelta(days=7)
+                cutoff_date = datetime.now(timezone.utc) - timedelta(days=7)
+                
+                # Delete in bounded batches so each transaction holds its locks and WAL briefly
+                batch = (
+                    select(OddsSnapshot.id)
+                    .where(OddsSnapshot.captured_at < cutoff_date)
+                    .limit(SNAPSHOT_CLEANUP_BATCH_SIZE)
+                    .scalar_subquery()
+                )
+                stmt = delete(OddsSnapshot).where(OddsSnapshot.id.in_(batch))
+                
+                deleted = 0
+                while self.running:
+                    result = await db.execute(stmt)
+                    await db.commit()
+                    deleted += result.rowcount
+                    
+                    if result.rowcount < SNAPSHOT_CLEANUP_BATCH_SIZE:
+                        break
+                    await asyncio.sleep(0.1)  # Let the write path in between batches
+                
+                if deleted > 0:
+                    logger.info(f"Deleted {deleted} old odds snapshots")
+                    
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Error cleaning up old odds snapshots: {e}")
+
+    async def _cleanup_stale_arb_candidates(self):
+        """Drop market candidates whose odds are too old for detection to use"""
+        from app.core.database import AsyncSessionLocal
+        from app.models.events import MarketArbCandidate
+        from sqlalchemy import delete
+        
+        async with AsyncSessionLocal() as db:
+            try:
+                cutoff_date = datetime.now(timezone.utc) - timedelta(minutes=settings.ODDS_MAX_AGE_MINUTES)
                 
-                stmt = delete(OddsSnapshot).where(OddsSnapshot.captured_at < cutoff_date)
+                stmt = delete(MarketArbCandidate).where(MarketArbCandidate.updated_at < cutoff_date)
                 result = await db.execute(stmt)
                 await db.commit()
                 
                 if result.rowcount > 0:
-                    logger.info(f"Deleted {result.rowcount} old odds snapshots")
+                    logger.info(f"Deleted {result.rowcount} stale market candidates")
                     
             except Exception as e:
                 await db.rollback()
-                logger.error(f"Error cleaning up old odds snapshots: {e}")
+                logger.error(f"Error cleaning up stale market candidates: {e}")
 
 # Global instance
 background_task_manager = BackgroundTaskManager()
@@ -1,35 +1,76 @@
 import asyncio
+import sys
+from functools import lru_cache
 import aiohttp
-from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Set, Tuple
+from datetime import datetime, timedelta, timezone
 import logging
 from app.core.config import settings
-from app.models.events import Event, OddsSnapshot, BookmakerStatus
+from app.models.events import Event, OddsSnapshot, BookmakerStatus, MarketArbCandidate
 from app.core.database import AsyncSessionLocal
-from sqlalchemy import select, update
-import json
+from app.core.cache import redis_client
+from sqlalchemy import select, update, insert, func, lambda_stmt, and_, desc, cast, Float
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Redis hash of the last ETag seen per sport, so restarts keep sending conditional requests
+ETAG_CACHE_KEY = "odds_etags"
+
+# Common outcome name mappings
+_OUTCOME_MAP: Dict[str, str] = {
+    sys.intern(name): sys.intern(key)
+    for name, key in {
+        "1": "home",
+        "2": "away",
+        "x": "draw",
+        "draw": "draw",
+        "tie": "draw",
+        "over": "over",
+        "under": "under"
+    }.items()
+}
+
+@lru_cache(maxsize=4096)
+def _normalize_outcome_name(outcome_name: str) -> str:
+    """Normalize an outcome name; names repeat across events so results are cached"""
+    cleaned = outcome_name.lower().strip()
+    return _OUTCOME_MAP.get(cleaned) or sys.intern(cleaned)
+
 class OddsCollector:
     def __init__(self):
         self.session: Optional[aiohttp.ClientSession] = None
         self.supported_sports = ["soccer", "americanfootball_nfl", "basketball_nba", "tennis"]
         self.bookmakers = ["bet365", "pinnacle", "betfair", "draftkings", "fanduel"]
+        # Caps concurrent Odds API requests; a rate-limited request backs off while holding its slot
+        self._semaphore = asyncio.Semaphore(settings.ODDS_API_CONCURRENCY)
+        # Last ETag per sport; unchanged payloads come back as an empty 304
+        self._etags: Dict[str, str] = {}
+        self._etags_loaded = False
+        # Set whenever a cycle stores new odds; the scheduler uses it to run detection straight away
+        self.new_odds_event = asyncio.Event()
         
-    async def __aenter__(self):
-        self.session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=30),
-            headers={"User-Agent": "ArbitrageBot/1.0"}
-        )
-        return self
-        
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Shared HTTP session, kept open across cycles so connections to the API stay warm"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30),
+                headers={"User-Agent": "ArbitrageBot/1.0"}
+            )
+        return self.session
+
+    async def aclose(self):
+        """Close the shared HTTP session"""
+        try:
+            if self.session and not self.session.closed:
+                await self.session.close()
+        except Exception as e:
+            logger.warning(f"Error closing odds API session: {e}")
 
-    async def collect_odds_for_sport(self, sport: str) -> List[Dict[str, Any]]:
-        """Collect odds for a specific sport from The Odds API"""
+    async def collect_odds_for_sport(self, sport: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Collect odds for a specific sport from The Odds API, with the response's ETag"""
         try:
             url = f"{settings.ODDS_API_BASE_URL}/sports/{sport}/odds"
             params = {
@@ -40,22 +81,53 @@ class OddsCollector:
                 "dateFormat": "iso"
             }
             
-            async with self.session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Collected {len(data)} events for {sport}")
-                    return data
-                elif response.status == 429:
-                    logger.warning(f"Rate limited for {sport}")
-                    await self._handle_rate_limit(response.headers)
-                    return []
-                else:
-                    logger.error(f"API error for {sport}: {response.status}")
-                    return []
+            headers = {}
+            etag = self._etags.get(sport)
+            if etag:
+                headers["If-None-Match"] = etag
+            
+            async with self._semaphore:
+                async with self._get_session().get(url, params=params, headers=headers) as response:
+                    if response.status == 200:
+                        data = await response.json(loads=orjson.loads)
+                        logger.info(f"Collected {len(data)} events for {sport}")
+                        # The caller saves the ETag only once the payload is stored
+                        return data, response.headers.get("ETag")
+                    elif response.status == 304:
+                        # Nothing changed since the last cycle; skip parsing and storage
+                        logger.info(f"Odds unchanged for {sport}")
+                        return [], None
+                    elif response.status == 429:
+                        logger.warning(f"Rate limited for {sport}")
+                        await self._handle_rate_limit(response.headers)
+                        return [], None
+                    else:
+                        logger.error(f"API error for {sport}: {response.status}")
+                        return [], None
                     
         except Exception as e:
             logger.error(f"Error collecting odds for {sport}: {e}")
-            return []
+            return [], None
+
+    async def _load_etags(self):
+        """Load ETags persisted by a previous process"""
+        self._etags_loaded = True
+        try:
+            stored = await redis_client.hgetall(ETAG_CACHE_KEY)
+            self._etags.update({sport.decode(): etag.decode() for sport, etag in stored.items()})
+        except Exception as e:
+            logger.warning(f"Failed to load odds ETags: {e}")
+
+    async def _store_etag(self, sport: str, etag: Optional[str]):
+        """Remember a sport's ETag in memory and in Redis"""
+        if not etag or self._etags.get(sport) == etag:
+            return
+        
+        self._etags[sport] = etag
+        try:
+            await redis_client.hset(ETAG_CACHE_KEY, sport, etag)
+        except Exception as e:
+            logger.warning(f"Failed to persist ETag for {sport}: {e}")
 
     async def _handle_rate_limit(self, headers: Dict[str, str]):
         """Handle rate limiting with exponential backoff"""
@@ -76,9 +148,8 @@ class OddsCollector:
                     "external_id": event_data["id"],
                     "sport": event_data["sport_key"],
                     "teams": [event_data["home_team"], event_data["away_team"]],
-                    "commence_time": datetime.fromisoformat(
-                        event_data["commence_time"].replace('Z', '+00:00')
-                    ),
+                    # Python 3.11's fromisoformat parses the trailing "Z" in C
+                    "commence_time": datetime.fromisoformat(event_data["commence_time"]),
                     "bookmakers": {}
                 }
                 
@@ -88,9 +159,7 @@ class OddsCollector:
                     if bookmaker_name in self.bookmakers:
                         normalized_event["bookmakers"][bookmaker_name] = {
                             "markets": {},
-                            "last_update": datetime.fromisoformat(
-                                bookmaker_data["last_update"].replace('Z', '+00:00')
-                            )
+                            "last_update": datetime.fromisoformat(bookmaker_data["last_update"])
                         }
                         
                         # Process markets
@@ -115,109 +184,200 @@ class OddsCollector:
 
     def _normalize_outcome_key(self, outcome_name: str) -> str:
         """Normalize outcome names across bookmakers"""
-        outcome_name = outcome_name.lower().strip()
-        
-        # Common mappings
-        mappings = {
-            "1": "home",
-            "2": "away", 
-            "x": "draw",
-            "draw": "draw",
-            "tie": "draw",
-            "over": "over",
-            "under": "under"
-        }
-        
-        return mappings.get(outcome_name, outcome_name)
+        return _OUTCOME_MAP.get(outcome_name) or _normalize_outcome_name(outcome_name)
 
     async def store_events_and_odds(self, normalized_events: List[Dict[str, Any]]):
         """Store events and odds in database"""
+        if not normalized_events:
+            return
+        
         async with AsyncSessionLocal() as db:
             try:
-                for event_data in normalized_events:
-                    # Upsert event
-                    stmt = select(Event).where(Event.external_id == event_data["external_id"])
-                    result = await db.execute(stmt)
-                    event = result.scalar_one_or_none()
-                    
-                    if not event:
-                        event = Event(
-                            external_id=event_data["external_id"],
-                            sport=event_data["sport"],
-                            teams=event_data["teams"],
-                            commence_time=event_data["commence_time"]
-                        )
-                        db.add(event)
-                        await db.flush()
-                    
-                    # Store odds snapshots
+                # Upsert all events in one statement; ON CONFLICT needs unique keys, last occurrence wins
+                events_by_external_id = {
+                    event_data["external_id"]: event_data for event_data in normalized_events
+                }
+                event_rows = [
+                    {
+                        "external_id": event_data["external_id"],
+                        "sport": event_data["sport"],
+                        "teams": event_data["teams"],
+                        "commence_time": event_data["commence_time"]
+                    }
+                    for event_data in events_by_external_id.values()
+                ]
+                
+                upsert_stmt = pg_insert(Event).values(event_rows)
+                upsert_stmt = (
+                    upsert_stmt
+                    .on_conflict_do_update(
+                        index_elements=[Event.external_id],
+                        set_={
+                            "commence_time": upsert_stmt.excluded.commence_time,
+                            "updated_at": func.now()
+                        }
+                    )
+                    .returning(Event.external_id, Event.id)
+                )
+                result = await db.execute(upsert_stmt)
+                event_ids = dict(result.all())
+                
+                # Store odds snapshots with a single multi-row INSERT
+                snapshot_rows = []
+                bookmakers_seen = set()
+                for external_id, event_data in events_by_external_id.items():
                     for bookmaker, bookmaker_data in event_data["bookmakers"].items():
-                        odds_snapshot = OddsSnapshot(
-                            event_id=event.id,
-                            bookmaker=bookmaker,
-                            odds_data=bookmaker_data["markets"],
-                            captured_at=bookmaker_data["last_update"]
-                        )
-                        db.add(odds_snapshot)
-                        
-                        # Update bookmaker status
-                        await self._update_bookmaker_status(db, bookmaker, True)
+                        snapshot_rows.append({
+                            "event_id": event_ids[external_id],
+                            "bookmaker": bookmaker,
+                            "odds_data": bookmaker_data["markets"],
+                            "captured_at": bookmaker_data["last_update"]
+                        })
+                        bookmakers_seen.add(bookmaker)
+                
+                if snapshot_rows:
+                    await db.execute(insert(OddsSnapshot), snapshot_rows)
+                    await db.execute(self._refresh_arb_candidates_stmt(list(event_ids.values())))
+                
+                # Update bookmaker status once per bookmaker, not once per snapshot
+                await self._update_bookmaker_statuses(db, bookmakers_seen, True)
                 
                 await db.commit()
-                logger.info(f"Stored {len(normalized_events)} events with odds")
+                logger.info(f"Stored {len(event_rows)} events with {len(snapshot_rows)} odds snapshots")
                 
             except Exception as e:
                 await db.rollback()
                 logger.error(f"Error storing events and odds: {e}")
                 raise
 
-    async def _update_bookmaker_status(self, db, bookmaker: str, success: bool):
-        """Update bookmaker status based on API response"""
-        stmt = select(BookmakerStatus).where(BookmakerStatus.bookmaker == bookmaker)
-        result = await db.execute(stmt)
-        status = result.scalar_one_or_none()
+    def _refresh_arb_candidates_stmt(self, event_ids: List):
+        """Upsert each market's best-price implied total for the given events, computed in SQL"""
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=settings.ODDS_MAX_AGE_MINUTES)
         
-        if not status:
-            status = BookmakerStatus(bookmaker=bookmaker)
-            db.add(status)
+        # Latest active snapshot per (event, bookmaker), as the detector sees it
+        latest = (
+            select(OddsSnapshot.event_id, OddsSnapshot.odds_data)
+            .distinct(OddsSnapshot.event_id, OddsSnapshot.bookmaker)
+            .where(
+                and_(
+                    OddsSnapshot.event_id.in_(event_ids),
+                    OddsSnapshot.is_active == True,
+                    OddsSnapshot.captured_at > cutoff
+                )
+            )
+            .order_by(OddsSnapshot.event_id, OddsSnapshot.bookmaker, desc(OddsSnapshot.captured_at))
+            .subquery()
+        )
         
-        if success:
-            status.api_status = "healthy"
-            status.last_successful_fetch = datetime.utcnow()
-            status.error_count = 0
-        else:
-            status.error_count += 1
-            if status.error_count > 5:
-                status.api_status = "degraded"
-            if status.error_count > 20:
-                status.api_status = "down"
+        # odds_data is {market: {outcome: price}}; unnest both levels
+        market = func.jsonb_each(latest.c.odds_data).table_valued("key", "value", joins_implicitly=True).alias("market")
+        outcome = func.jsonb_each_text(market.c.value).table_valued("key", "value", joins_implicitly=True).alias("outcome")
+        
+        best_prices = (
+            select(
+                latest.c.event_id,
+                market.c.key.label("market_type"),
+                func.max(cast(outcome.c.value, Float)).label("best_price")
+            )
+            .select_from(latest, market, outcome)
+            .group_by(latest.c.event_id, market.c.key, outcome.c.key)
+            .subquery()
+        )
+        
+        totals = (
+            select(
+                best_prices.c.event_id,
+                best_prices.c.market_type,
+                func.sum(1.0 / best_prices.c.best_price),
+                func.now()
+            )
+            .where(best_prices.c.best_price > 0)
+            .group_by(best_prices.c.event_id, best_prices.c.market_type)
+            .having(func.count() >= 2)  # a market needs at least two outcomes
+        )
+        
+        stmt = pg_insert(MarketArbCandidate).from_select(
+            ["event_id", "market_type", "min_implied_total", "updated_at"], totals
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[MarketArbCandidate.event_id, MarketArbCandidate.market_type],
+            set_={
+                "min_implied_total": stmt.excluded.min_implied_total,
+                "updated_at": stmt.excluded.updated_at
+            }
+        )
+
+    async def _update_bookmaker_statuses(self, db, bookmakers: Set[str], success: bool):
+        """Update bookmaker statuses based on API response"""
+        bookmaker_list = sorted(bookmakers)
+        
+        # One lookup for every bookmaker; the lambda keeps the compiled statement cached across cycles
+        stmt = lambda_stmt(
+            lambda: select(BookmakerStatus).where(BookmakerStatus.bookmaker.in_(bookmaker_list))
+        )
+        result = await db.execute(stmt)
+        statuses = {status.bookmaker: status for status in result.scalars()}
+        now = datetime.now(timezone.utc)
+        
+        for bookmaker in bookmaker_list:
+            status = statuses.get(bookmaker)
+            if not status:
+                status = BookmakerStatus(bookmaker=bookmaker)
+                db.add(status)
+            
+            if success:
+                status.api_status = "healthy"
+                status.last_successful_fetch = now
+                status.error_count = 0
+            else:
+                status.error_count += 1
+                if status.error_count > 5:
+                    status.api_status = "degraded"
+                if status.error_count > 20:
+                    status.api_status = "down"
 
     async def collect_all_odds(self):
         """Main method to collect odds for all supported sports"""
         logger.info("Starting odds collection cycle")
         
-        async with self:
-            all_events = []
-            
-            for sport in self.supported_sports:
-                try:
-                    raw_odds = await self.collect_odds_for_sport(sport)
-                    if raw_odds:
-                        normalized_odds = await self.normalize_odds_data(raw_odds)
-                        all_events.extend(normalized_odds)
-                        
-                    # Rate limiting between sports
-                    await asyncio.sleep(1)
-                    
-                except Exception as e:
-                    logger.error(f"Error collecting odds for {sport}: {e}")
-                    continue
-            
-            if all_events:
-                await self.store_events_and_odds(all_events)
-                logger.info(f"Odds collection completed: {len(all_events)} events processed")
-            else:
-                logger.warning("No odds data collected")
+        if not self._etags_loaded:
+            await self._load_etags()
+        
+        all_events = []
+        new_etags = {}
+        
+        # Fetch all sports concurrently; the semaphore keeps us within the API's limits
+        results = await asyncio.gather(
+            *[self.collect_odds_for_sport(sport) for sport in self.supported_sports],
+            return_exceptions=True
+        )
+        
+        for sport, result in zip(self.supported_sports, results):
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                raw_odds, etag = result
+                if raw_odds:
+                    normalized_odds = await self.normalize_odds_data(raw_odds)
+                    all_events.extend(normalized_odds)
+                if etag:
+                    new_etags[sport] = etag
+                
+            except Exception as e:
+                logger.error(f"Error collecting odds for {sport}: {e}")
+                continue
+        
+        if all_events:
+            await self.store_events_and_odds(all_events)
+            self.new_odds_event.set()
+            logger.info(f"Odds collection completed: {len(all_events)} events processed")
+        else:
+            logger.warning("No odds data collected")
+        
+        # Only now is the payload behind each ETag safely stored; a failed store raises above,
+        # so the next cycle fetches the full payload again instead of getting a 304
+        for sport, etag in new_etags.items():
+            await self._store_etag(sport, etag)
 
 # Singleton instance
 odds_collector = OddsCollector()